@@ -3,6 +3,9 @@ import time
 import sys
 import configparser
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from pipeline import Pipeline
+
 if len(sys.argv) >= 2:
     CONFIG_PATH = sys.argv[1]
 else:
@@ -16,6 +19,8 @@ DATA_SOURCE = config.get('meta', 'kg_source')
 USE_ATTENTION = config.getboolean('entity linking', 'attention')
 USE_LEGACY_EMBEDDINGS = config.getboolean('legacy', 'use_legacy_embeddings')
 TESTRUN = config.getboolean('misc', 'testrun')
+IN_PROCESS = config.getboolean('meta', 'in_process', fallback=True)
+USE_CACHE = config.getboolean('meta', 'use_cache', fallback=True)
 starttime = time.time()
 EXPERIMENT_ID = time.strftime('%d_%m_%Y-%H_%M', time.gmtime(starttime))
 
@@ -25,18 +30,33 @@ else:
     DATA_FOLDER = f"./data/experiment {EXPERIMENT_ID}/"
 
 os.makedirs(DATA_FOLDER, exist_ok=True)
+CACHE_PATH = os.path.join(DATA_FOLDER, 'stage cache.json') if USE_CACHE else None
+METRICS_PATH = os.path.join(DATA_FOLDER, 'metrics.jsonl')
 
 print(f'running experiment: {EXPERIMENT_ID}')
 print(f'-with data source {DATA_SOURCE}')
 print(f'-running for {NUM_ITERATIONS} iterations')
 print(f'-with config {CONFIG_PATH}')
+if IN_PROCESS:
+    print('-running stages in process')
+if USE_CACHE:
+    print(f'-reusing unchanged stage results from {DATA_FOLDER}')
 
 if TESTRUN:
     print("""
     ---------------- STARTING TESTRUN ----------------
     """)
 
-os.system(f"python ./scripts/prepareSchema.py \"{CONFIG_PATH}\"")
+pipeline = Pipeline(config, in_process=IN_PROCESS, cache_path=CACHE_PATH, metrics_path=METRICS_PATH)
+db = pipeline.db
+
+# connection and tables used by all database stages
+DB_CONFIG = ['postGIS', ('entity linking', 'base_table'), ('entity linking', 'prediction_table')]
+VIEW_CONFIG = DB_CONFIG + [('entity linking', 'view_name'), ('entity linking', 'index_name')]
+
+pipeline.run_stage('prepareSchema.py', CONFIG_PATH,
+                   config=VIEW_CONFIG + [('meta', 'kg_source')],
+                   outputs=[db.predictions(0)])
 for iteration in range(1, NUM_ITERATIONS + 1):
     print(f"""
     ==================================
@@ -45,51 +65,128 @@ for iteration in range(1, NUM_ITERATIONS + 1):
     """)
     it_folder = DATA_FOLDER + f'it_{iteration}/'
     os.makedirs(it_folder, exist_ok=True)
-    os.system(f"python ./scripts/osm2rdf.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+    pipeline.run_stage('osm2rdf.py', it_folder, CONFIG_PATH, iteration=iteration,
+                       config=DB_CONFIG + ['misc'],
+                       inputs=[db.predictions(iteration - 1)],
+                       outputs=[it_folder + 'osm rbf.tsv'])
 
     # read kg data for osm linked entities
+    nca_dataset = [it_folder + 'nca dataset.npz', it_folder + 'nca dataset rows.parquet', it_folder + 'nca dataset columns.parquet']
+    read_inputs = [it_folder + 'osm rbf.tsv', config.get('nca', 'osm_tag_location'), config.get('nca', 'osm_key_location')]
     if DATA_SOURCE == 'wikidata':
-        os.system(f"python ./scripts/readRDFWikidata.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+        pipeline.run_stage('readRDFWikidata.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           config=['nca', 'misc', ('wikidata scrape', 'backend'), ('wikidata scrape', 'dump_location')],
+                           inputs=read_inputs,
+                           outputs=nca_dataset + [it_folder + 'qid_index.tsv'])
     else:
         # DATA_SOURCE == 'dbpedia'
-        os.system(f"python ./scripts/readRDFDBpedia.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+        pipeline.run_stage('readRDFDBpedia.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           config=['nca', 'misc', ('dbpedia scrape', 'backend'), ('dbpedia scrape', 'dump_location')],
+                           inputs=read_inputs,
+                           outputs=nca_dataset)
 
     # train class matchings for classes in osm and kg
-    os.system(f"python ./scripts/schemaMatch.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+    pipeline.run_stage('schemaMatch.py', it_folder, CONFIG_PATH, iteration=iteration,
+                       config=['nca', 'misc'],
+                       inputs=nca_dataset,
+                       outputs=[it_folder + 'predicted classes.tsv'])
 
     # read data for all entities of predicted kg class matches
+    reform_inputs = [it_folder + 'predicted classes.tsv', db.predictions(iteration - 1)]
+    if config.get('nca', 'columns_location').strip():
+        reform_inputs.append(config.get('nca', 'columns_location').strip())
+    reform_outputs = [it_folder + 'wikidata classes.txt', it_folder + 'create view.sql', db.view()]
     if DATA_SOURCE == 'wikidata':
-        os.system(f"python ./scripts/reformClasses.py \"{it_folder}\" \"{CONFIG_PATH}\"")
-        os.system(f"python ./scripts/scrapeWikiData.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+        pipeline.run_stage('reformClasses.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           config=VIEW_CONFIG + [('nca', 'columns_location'), ('candidate generation', 'method'), ('legacy', 'use_legacy_embeddings')],
+                           inputs=reform_inputs + [it_folder + 'qid_index.tsv'],
+                           outputs=reform_outputs)
+        pipeline.run_stage('scrapeWikiData.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           config=['wikidata scrape', 'misc'],
+                           inputs=[it_folder + 'wikidata classes.txt'],
+                           outputs=[it_folder + 'wikidata dump.parquet'])
     else:
         # DATA_SOURCE == 'dbpedia'
-        os.system(f"python ./scripts/reformClassesDBP.py \"{it_folder}\" \"{CONFIG_PATH}\"")
-        os.system(f"python ./scripts/scrapeDBPedia.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+        pipeline.run_stage('reformClassesDBP.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           config=VIEW_CONFIG + [('nca', 'columns_location'), ('candidate generation', 'method'), ('legacy', 'use_legacy_embeddings')],
+                           inputs=reform_inputs,
+                           outputs=reform_outputs)
+        pipeline.run_stage('scrapeDBPedia.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           config=['dbpedia scrape', 'misc'],
+                           inputs=[it_folder + 'wikidata classes.txt'],
+                           outputs=[it_folder + 'wikidata dump.parquet'])
 
     # generate fitting osm candidate pairs
-    os.system(f"python ./scripts/candidateGeneration.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+    if USE_LEGACY_EMBEDDINGS:
+        pair_files = [it_folder + 'train pairs.tsv', it_folder + 'unmatched pairs.tsv']
+        entity_files = []
+    else:
+        # pair tables with kg and osm entities in shared side tables
+        pair_files = [it_folder + 'train pairs.parquet', it_folder + 'unmatched pairs.parquet']
+        entity_files = [it_folder + 'kg entities.parquet', it_folder + 'osm entities.parquet']
+    pipeline.run_stage('candidateGeneration.py', it_folder, CONFIG_PATH, iteration=iteration,
+                       config=['candidate generation', 'misc', ('entity linking', 'view_name'), ('meta', 'kg_source'), ('legacy', 'use_legacy_embeddings')],
+                       inputs=[it_folder + 'wikidata dump.parquet', db.view()],
+                       outputs=pair_files + entity_files)
 
     if not USE_LEGACY_EMBEDDINGS:
+        linking_config = [('fasttext', 'location'), ('entity linking', 'attention'), ('entity linking', 'attention_dimension'),
+                          ('entity linking', 'linear_dimension'), ('entity linking', 'epochs'), ('entity linking', 'prediction_threshold')]
         # embed unstructured text information and train classifier
         if USE_ATTENTION:
-            os.system(f"python ./scripts/entityLinkingAttention.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+            model_files = [it_folder + 'keras model', it_folder + 'osm tokenizer.sav', it_folder + 'wikidata tokenizer.sav']
+            pipeline.run_stage('entityLinkingAttention.py', it_folder, CONFIG_PATH, iteration=iteration,
+                               config=linking_config,
+                               inputs=pair_files[:1] + entity_files,
+                               outputs=model_files + [it_folder + 'class_report.txt'])
+            prediction_inputs = pair_files[1:] + entity_files + model_files
         else:
-            os.system(f"python ./scripts/computeFTEmbeddings.py \"{it_folder}\" \"{CONFIG_PATH}\"")
-            os.system(f"python ./scripts/entityLinking.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+            # pairs without text columns and the float32 matrix of their fasttext encodings
+            embedding_files = [it_folder + 'el training set.parquet', it_folder + 'el training set embeddings.npy',
+                               it_folder + 'el prediction set.parquet', it_folder + 'el prediction set embeddings.npy']
+            model_files = [it_folder + config.get('legacy', 'model') + '.sav']
+            pipeline.run_stage('computeFTEmbeddings.py', it_folder, CONFIG_PATH, iteration=iteration,
+                               config=[('fasttext', 'location'), ('wikidata scrape', 'scrape_values')],
+                               inputs=pair_files + entity_files,
+                               outputs=embedding_files)
+            pipeline.run_stage('entityLinking.py', it_folder, CONFIG_PATH, iteration=iteration,
+                               config=['legacy'],
+                               inputs=embedding_files[:2],
+                               outputs=model_files + [it_folder + 'class_report.txt'])
+            prediction_inputs = embedding_files[2:] + model_files
 
         # predict unknown matches for next iteration
-        os.system(f"python ./scripts/predictUnmatched.py \"{it_folder}\" \"{CONFIG_PATH}\" {iteration}")
+        pipeline.run_stage('predictUnmatched.py', it_folder, CONFIG_PATH, iteration, iteration=iteration,
+                           config=DB_CONFIG + linking_config + [('entity linking', 'model')],
+                           inputs=prediction_inputs,
+                           outputs=[it_folder + 'predicted entity matches.tsv', db.predictions(iteration)])
 
     else:
         # run tests using custom trained embeddings
-        os.system(f"python ./scripts/legacyEmbeddings/transformForKV.py \"{it_folder}\" \"{CONFIG_PATH}\"")
-        os.system(f"python ./scripts/legacyEmbeddings/embeddingKeyValue.py \"{it_folder}\" \"{CONFIG_PATH}\"")
-        os.system(f"python ./scripts/legacyEmbeddings/prepareTrainingFromKV.py \"{it_folder}\" \"{CONFIG_PATH}\"")
-        os.system(f"python ./scripts/entityLinking.py \"{it_folder}\" \"{CONFIG_PATH}\"")
+        pipeline.run_stage('legacyEmbeddings/transformForKV.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           inputs=pair_files[:1],
+                           outputs=[it_folder + 'keyvals.tsv'])
+        pipeline.run_stage('legacyEmbeddings/embeddingKeyValue.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           config=[('legacy', 'num_epochs'), ('legacy', 'embedding_dim')],
+                           inputs=[it_folder + 'keyvals.tsv'],
+                           outputs=[it_folder + 'custom embeddings.csv'])
+        pipeline.run_stage('legacyEmbeddings/prepareTrainingFromKV.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           inputs=pair_files[:1] + [it_folder + 'custom embeddings.csv'],
+                           outputs=[it_folder + 'el training set.parquet'])
+        pipeline.run_stage('entityLinking.py', it_folder, CONFIG_PATH, iteration=iteration,
+                           config=['legacy'],
+                           inputs=[it_folder + 'el training set.parquet'],
+                           outputs=[it_folder + config.get('legacy', 'model') + '.sav', it_folder + 'class_report.txt'])
         if NUM_ITERATIONS > 1:
             print('Breaking after one iteration')
             print('Legacy embeddings are not used in multiple iteration strategy')
         break
 
+    pipeline.end_iteration()
+
+pipeline.close()
+
 print('experiment finished')
 print(f"-runtime: {time.strftime('%H:%M:%S', time.gmtime(time.time() - starttime))}")
+print(f'-stage metrics written to {METRICS_PATH}')
+print(pipeline.summary())
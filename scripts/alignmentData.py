@@ -0,0 +1,147 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.compute as pc
+import scipy.sparse as sp
+
+TRIPLE_COLUMNS = ['node', 'key', 'value']
+NODE_PREFIX = '<https://www.openstreetmap.org/node/'
+KEY_PREFIX = '<https://wiki.openstreetmap.org/wiki/Key:'
+COLUMNS_SUFFIX = ' columns.parquet'
+ROWS_SUFFIX = ' rows.parquet'
+
+
+def read_osm_triples(path: str, strip_backslashes: bool = False) -> pd.DataFrame:
+    """
+    read triples written by osm2rdf into a dataframe
+    rows without exactly three tab separated fields are skipped
+    :param path: path to the triple file
+    :param strip_backslashes: additionally remove backslashes from values
+    :return: dataframe with columns node, key, value and tagKey (key=value)
+    """
+    table = pv.read_csv(
+        path,
+        read_options=pv.ReadOptions(column_names=TRIPLE_COLUMNS, block_size=1 << 26),
+        parse_options=pv.ParseOptions(delimiter='\t', invalid_row_handler=lambda row: 'skip'),
+        convert_options=pv.ConvertOptions(column_types={c: pa.string() for c in TRIPLE_COLUMNS},
+                                          strings_can_be_null=False, quoted_strings_can_be_null=False)
+    )
+
+    # remove uri prefixes of nodes and keys
+    node = pc.replace_substring(pc.replace_substring(table['node'], NODE_PREFIX, ''), '>', '')
+    key = pc.replace_substring(pc.replace_substring(table['key'], KEY_PREFIX, ''), '>', '')
+    value = pc.replace_substring(table['value'], '"', '')  # remove abundance of quotation marks
+    if strip_backslashes:
+        value = pc.replace_substring(value, '\\', '')
+    tag_key = pc.binary_join_element_wise(key, value, '=')
+
+    return pa.table({'node': node, 'key': key, 'value': value, 'tagKey': tag_key}).to_pandas()
+
+
+def osm_tag_keys(data: pd.DataFrame, tags: list) -> pd.Series:
+    """
+    use key=value for tags listed in the osm tag file and the plain key for all others
+    :param data: triples as returned by read_osm_triples
+    :param tags: known osm tags (key=value)
+    :return: series with tag or key per triple
+    """
+    return data['tagKey'].where(data['tagKey'].isin(set(tags)), data['key'])
+
+
+def tfidf_weights(data: pd.DataFrame, n: int = 40, skip_classes: tuple = ('human',)) -> pd.DataFrame:
+    """
+    weight properties per class: tf = number of statements of the property within the class,
+    df = number of classes using the property
+    :param data: dataframe with columns cls and prop, one row per statement
+    :param n: constant N of the idf term log(N/df)
+    :param skip_classes: classes without weights, still counted for df
+    :return: dataframe with columns cls, prop and tfidfval, weights of 0 are dropped
+    """
+    tf = data.groupby(['cls', 'prop']).size()
+    df = data.groupby('prop')['cls'].nunique()
+    weights = tf * np.log(n / df.reindex(tf.index.get_level_values('prop')).to_numpy())
+    weights = weights.rename('tfidfval').reset_index()
+    weights = weights[~weights['cls'].isin(skip_classes)]
+    return weights[weights['tfidfval'] != 0].reset_index(drop=True)
+
+
+def top_properties(weights: pd.DataFrame, k: int = 25) -> pd.DataFrame:
+    """
+    highest weighted properties of every class
+    :param weights: dataframe as returned by tfidf_weights
+    :param k: number of properties kept per class
+    :return: weights sorted by class and descending weight, at most k rows per class
+    """
+    ordered = weights.sort_values(['cls', 'tfidfval'], ascending=[True, False])
+    return ordered.groupby('cls', sort=False).head(k).reset_index(drop=True)
+
+
+def one_hot_counts(frame: pd.DataFrame, index_columns: list, column: str, prefix: str):
+    """
+    sparse equivalent of get_dummies on column followed by a groupby sum over index_columns
+    :param frame: dataframe to encode
+    :param index_columns: columns identifying a row of the result
+    :param column: categorical column to encode
+    :param prefix: prefix of the column names, separated by _
+    :return: (dataframe of index_columns per row, csr matrix of counts, list of column names)
+    """
+    row_codes = frame.groupby(index_columns, sort=True).ngroup().to_numpy()
+    col_codes, categories = pd.factorize(frame[column], sort=True)
+    valid = (row_codes >= 0) & (col_codes >= 0)
+    rows = frame[index_columns].drop_duplicates().dropna().sort_values(index_columns).reset_index(drop=True)
+    matrix = sp.coo_matrix((np.ones(valid.sum(), dtype=np.int32), (row_codes[valid], col_codes[valid])),
+                           shape=(len(rows), len(categories))).tocsr()  # duplicates are summed up
+    return rows, matrix, [f'{prefix}_{c}' for c in categories]
+
+
+def build_dataset(tags, props, classes, key: str):
+    """
+    join osm tag counts of linked entities with the property and class counts of their kg entities
+    sparse equivalent of merging the dummy encoded dataframes on key
+    :param tags: one_hot_counts of osm tags indexed by osm_id and key
+    :param props: one_hot_counts of kg properties indexed by key
+    :param classes: one_hot_counts of kg classes indexed by key
+    :param key: column holding the kg entity
+    :return: (dataframe with osm_id and key per row, csr matrix, list of column names)
+    """
+    tag_rows, tag_matrix, tag_columns = tags
+    prop_rows, prop_matrix, prop_columns = props
+    cls_rows, cls_matrix, cls_columns = classes
+
+    prop_pos = pd.Series(np.arange(len(prop_rows)), index=prop_rows[key])
+    cls_pos = pd.Series(np.arange(len(cls_rows)), index=cls_rows[key])
+    keep = tag_rows[key].isin(prop_pos.index) & tag_rows[key].isin(cls_pos.index)
+    rows = tag_rows[keep].reset_index(drop=True)
+
+    matrix = sp.hstack([tag_matrix[keep.to_numpy()],
+                        prop_matrix[prop_pos[rows[key]].to_numpy()],
+                        cls_matrix[cls_pos[rows[key]].to_numpy()]], format='csr')
+    return rows, matrix, tag_columns + prop_columns + cls_columns
+
+
+def save_dataset(path: str, dataset) -> None:
+    """
+    write the matrix to path (.npz) and the row and column names to parquet files next to it
+    :param path: path of the npz file
+    :param dataset: (rows, matrix, columns) as returned by build_dataset
+    :return:
+    """
+    rows, matrix, columns = dataset
+    base = os.path.splitext(path)[0]
+    rows.to_parquet(base + ROWS_SUFFIX, engine='pyarrow', index=False)
+    pd.DataFrame({'column': columns}).to_parquet(base + COLUMNS_SUFFIX, engine='pyarrow', index=False)
+    sp.save_npz(path, matrix)
+
+
+def load_dataset(path: str):
+    """
+    read a dataset written by save_dataset
+    :param path: path of the npz file
+    :return: (rows, csr matrix, columns)
+    """
+    base = os.path.splitext(path)[0]
+    rows = pd.read_parquet(base + ROWS_SUFFIX, engine='pyarrow')
+    columns = list(pd.read_parquet(base + COLUMNS_SUFFIX, engine='pyarrow')['column'])
+    return rows, sp.load_npz(path).tocsr(), columns
@@ -0,0 +1,79 @@
+import csv
+from queue import Queue, Empty
+from threading import Thread
+
+_STOP = object()
+
+
+class BatchWriter:
+    """
+    Threaded writer for tab separated files
+    Producers hand over rows through a bounded queue and block while it is full. The writing thread
+    sleeps until rows arrive and writes them in batches with writerows. close() writes all remaining
+    rows and stops the thread.
+    """
+    def __init__(self, filename: str, queue_size: int = 10000, batch_size: int = 1000):
+        """
+        :param filename: file to write to
+        :param queue_size: maximum number of chunks waiting to be written
+        :param batch_size: number of rows collected before writing them at once
+        """
+        self.filename = filename
+        self.batch_size = batch_size
+        self.queue = Queue(maxsize=queue_size)
+        self.error = None
+        self.thread = Thread(target=self._consume, daemon=True)
+        self.thread.start()
+
+    def put(self, row: list) -> None:
+        self.queue.put([row])
+
+    def put_many(self, rows: list) -> None:
+        """
+        hand over a chunk of rows, e.g. all rows of a single entity
+        :param rows: list of rows
+        :return:
+        """
+        if rows:
+            self.queue.put(rows)
+
+    def close(self) -> None:
+        """
+        write remaining rows and stop the writing thread
+        :return:
+        """
+        self.queue.put(_STOP)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _consume(self) -> None:
+        with open(self.filename, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, delimiter='\t')
+            stop = False
+            while not stop:
+                batch = []
+                item = self.queue.get()  # blocks until rows arrive
+                while True:
+                    if item is _STOP:
+                        stop = True
+                        break
+                    batch.extend(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self.queue.get_nowait()
+                    except Empty:
+                        break
+                if self.error is None:
+                    try:
+                        writer.writerows(batch)
+                    except Exception as e:
+                        # keep taking rows so producers do not block, raise in close()
+                        self.error = e
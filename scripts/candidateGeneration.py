@@ -1,15 +1,21 @@
 import os
-import csv
 import sys
+import itertools
+import time
 import configparser
 import pandas as pd
+import pyarrow.parquet as pq
+import numpy as np
 import asyncio
-import asyncpg
+from scipy.spatial import cKDTree
+import geoUtils
+import nameIndex
+import resources
+import stageMetrics
 from tqdm import tqdm
 from json import dumps
-from queue import Queue
-from threading import Thread
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from batchWriter import BatchWriter
+import candidateStore
 
 DATA_DIR = sys.argv[1]
 CONFIG_PATH = sys.argv[2]
@@ -17,82 +23,99 @@ CONFIG_PATH = sys.argv[2]
 config = configparser.ConfigParser()
 config.read(CONFIG_PATH)
 
-PW_FILENAME = config.get('postGIS', 'passwordfile')
-PG_HOST = config.get('postGIS', 'host')
-PG_USER = config.get('postGIS', 'user')
-PG_DB_NAME = config.get('postGIS', 'dbname')
-PG_PORT = config.getint('postGIS', 'port')
 VIEW_NAME = config.get('entity linking', 'view_name')
 DATA_SOURCE = config.get('meta', 'kg_source')
 MAX_CANDIDATES = config.getint('candidate generation', 'max_candidates')
 DIST_THRESHOLD = config.getint('candidate generation', 'dist_threshold')
+BLOCK_SIZE = config.getint('candidate generation', 'batch_size', fallback=0)
+WORKERS = config.getint('postGIS', 'pool_size', fallback=4)
+FETCH_SIZE = config.getint('postGIS', 'fetch_size', fallback=5000)
+MIN_SIMILARITY = config.getfloat('candidate generation', 'min_similarity', fallback=0.3)
+NAME_TILE_SIZE = config.getfloat('candidate generation', 'name_tile_size', fallback=0)
+SPATIAL_ORDER = config.get('candidate generation', 'order', fallback='none')
 GENERATION_METHOD = config.get('candidate generation', 'method')
-USE_LEGACY_EMBEDDINGS = config.getboolean('legacy', 'use_legacy_embeddings')
 LOG_FILENAME = os.path.join(DATA_DIR, 'generate_candidates_log.txt')
-MATCH_FILENAME = os.path.join(DATA_DIR, 'train_pairs.tsv')
-NO_MATCH_FILENAME = os.path.join(DATA_DIR, 'unmatched_pairs.tsv')
-DATA_PATH = os.path.join(DATA_DIR, 'wikidata_dump.parquet')
+USE_LEGACY_EMBEDDINGS = config.getboolean('legacy', 'use_legacy_embeddings')
+# legacy embedding scripts read tab separated pairs, everything else reads the normalized parquet tables
+if USE_LEGACY_EMBEDDINGS:
+    MATCH_FILENAME = os.path.join(DATA_DIR, 'train pairs.tsv')
+    NO_MATCH_FILENAME = os.path.join(DATA_DIR, 'unmatched pairs.tsv')
+else:
+    MATCH_FILENAME = os.path.join(DATA_DIR, candidateStore.PAIR_FILES['train'])
+    NO_MATCH_FILENAME = os.path.join(DATA_DIR, candidateStore.PAIR_FILES['unmatched'])
+DATA_PATH = os.path.join(DATA_DIR, 'wikidata dump.parquet')
 TESTRUN = config.getboolean('misc', 'testrun')
 LIMIT = config.getint('misc', 'limit')
+QUEUE_SIZE = config.getint('misc', 'queue_size', fallback=10000)
+BATCH_SIZE = config.getint('misc', 'write_batch_size', fallback=1000)
 
-with open(PW_FILENAME, 'r') as file:
-    password = file.read().strip()
-
-wiki_data = pd.read_parquet(DATA_PATH, engine='pyarrow')
+wiki_data = resources.consume(DATA_PATH, pq.read_table).to_pandas()
 
 if TESTRUN:
     print(f'Restricting candidate generation to {LIMIT} entities')
     wiki_data = wiki_data[:LIMIT]
 
-
-def filter_tags_concat(data: dict) -> str:
-    tag = []
-    for k, v in data.items():
-        if k not in ['way', 'osm_id', 'tags']:
-            tag.extend([k, v])
-        elif k == 'tags':
-            if v:
-                for k_tag, v_tag in v.items():
-                    if k_tag not in ['wikidata', 'wikipedia'] and not k_tag.startswith('osm_'):
-                        tag.extend([k_tag, v_tag])
-    return ' '.join(tag).replace('\n', ' ')
-
-
-def filter_tags_json(data: dict) -> str:
-    tags_dict = {}
-    for k, v in data.items():
-        if k not in ['way', 'osm_id', 'tags']:
-            tags_dict.update({k: v})
-        elif k == 'tags':
-            if v:
-                for k_tag, v_tag in v.items():
-                    if k_tag not in ['wikidata', 'wikipedia'] and not k_tag.startswith('osm_'):
-                        tags_dict.update({k_tag: v_tag})
-    return dumps(tags_dict)
-
-
-def consume(stop, queue, filename) -> None:
-    with open(filename, 'w', encoding='utf-8', newline='') as file:
-        writer = csv.writer(file, delimiter='\t')
-        while True:
-            if not queue.empty():
-                i = queue.get()
-                writer.writerow(i)
-            elif stop():
-                print('- Stopping file writing thread')
-                return
-
-
-async def fetch_candidates_for_point(conn, wiki_id, location, data, pair_queue, single_queue=None, threshold=2500, limit=100):
-    sql = f"""SELECT osm_id, ST_DISTANCE(way, ST_Transform(ST_GeomFromEWKT($1), 3857)) dist, jsonb_strip_nulls(to_jsonb(g)), wkid
+stageMetrics.count('rows_in', len(wiki_data))
+
+# kg locations are parsed once and projected to the coordinates of the osm geometries (EPSG:3857),
+# queries get plain x and y values instead of ewkt strings transformed on the server
+lon, lat = geoUtils.parse_points(wiki_data['location'])
+if GENERATION_METHOD not in ['name', 'ngram'] or USE_LEGACY_EMBEDDINGS:
+    # distance candidates need a location, entities without one are skipped
+    located = ~(np.isnan(lon) | np.isnan(lat))
+    if not located.all():
+        print(f'Skipping {int((~located).sum())} entities without valid location')
+        wiki_data, lon, lat = wiki_data[located], lon[located], lat[located]
+if SPATIAL_ORDER in ['hilbert', 'geohash']:
+    # consecutive queries touch neighbouring parts of the spatial index and heap
+    print(f'Ordering entities along {SPATIAL_ORDER} curve')
+    order = geoUtils.curve_order(lon, lat, SPATIAL_ORDER)
+    wiki_data, lon, lat = wiki_data.iloc[order], lon[order], lat[order]
+wiki_x, wiki_y = geoUtils.to_web_mercator(lon, lat)
+
+
+def tag_column(legacy=False) -> str:
+    # tags are precomputed as columns of the view, see reformClasses.py
+    return 'tag_json' if legacy else 'tag_text'
+
+
+def format_tags(tags, legacy=False) -> str:
+    return dumps(tags) if legacy else tags
+
+
+def nearest_sql(point: str, tag: str, threshold: str, limit: str, knn=False) -> str:
+    """
+    query for the nearest osm entities of a point, ordered by distance
+    :param point: sql expression of the point in EPSG:3857
+    :param tag: sql expression selecting the tags
+    :param threshold: sql expression of the maximum distance in meters
+    :param limit: sql expression of the maximum number of candidates
+    :param knn: scan the spatial index in distance order (<->) and cut off at the threshold afterwards,
+    instead of sorting every entity within the threshold
+    :return: sql query with columns osm_id, dist, tag and wkid
+    """
+    if knn:
+        return f"""SELECT * FROM (
+                      SELECT osm_id, ST_DISTANCE(g.way, {point}) dist, {tag}, wkid
+                      FROM {VIEW_NAME} g
+                      ORDER BY g.way <-> {point} LIMIT {limit}) n
+                  WHERE dist <= {threshold}
+                  ORDER BY dist ASC"""
+    return f"""SELECT osm_id, ST_DISTANCE(g.way, {point}) dist, {tag}, wkid
               FROM {VIEW_NAME} g
-              WHERE ST_DWithin(way, ST_Transform(ST_GeomFromEWKT($2), 3857), $3)
-              ORDER BY dist ASC LIMIT $4"""
+              WHERE ST_DWithin(g.way, {point}, {threshold})
+              ORDER BY dist ASC LIMIT {limit}"""
+
+
+async def fetch_candidates_for_point(conn, wiki_id, point, data, pair_writer, single_writer=None, threshold=2500, limit=100, knn=False):
+    # asyncpg prepares the statement once per connection and sends the coordinates as binary floats
+    sql = nearest_sql('ST_SetSRID(ST_MakePoint($1, $2), 3857)', 'tag_text', '$3', '$4', knn)
 
     is_linked = False
     res = []
+    stageMetrics.count('db_queries')
     async with conn.transaction():
-        async for record in conn.cursor(sql, f'SRID=4326; {location}', f'SRID=4326; {location}', threshold, limit):
+        async for record in conn.cursor(sql, point[0], point[1], threshold, limit):
             match = False
             id = record['wkid']
             if DATA_SOURCE == 'dbpedia':
@@ -100,24 +123,77 @@ async def fetch_candidates_for_point(conn, wiki_id, location, data, pair_queue,
             if id == wiki_id:
                 is_linked = True
                 match = True
-            res.append([wiki_id, record['osm_id'], match, record['dist'], filter_tags_concat(record['jsonb_strip_nulls'])] + data)
+            res.append([wiki_id, record['osm_id'], match, record['dist'], record['tag_text']] + data)
 
     if is_linked:
-        for entry in res:
-            pair_queue.put(entry)
+        pair_writer.put_many(res)
     else:
-        for entry in res:
-            single_queue.put(entry)
+        single_writer.put_many(res)
+    stageMetrics.count('rows_out', len(res))
+
+
+async def fetch_candidates_for_block(conn, block, pair_writer, single_writer=None, threshold=2500, limit=100, legacy=False, knn=False):
+    """
+    nearest candidates of a block of kg entities with a single query
+    the points are sent as arrays and resolved server side with one nearest neighbour subquery per point
+    :param conn: database connection
+    :param block: list of (wiki id, (x, y), data) tuples
+    :param pair_writer: writer for candidates of entities with a linked osm entity
+    :param single_writer: writer for candidates of entities without linked osm entity
+    :param threshold: maximum distance in meters
+    :param limit: maximum number of candidates per entity
+    :param legacy: write tags as json for legacy embeddings
+    :param knn: index ordered nearest neighbour scan, see nearest_sql
+    :return:
+    """
+    sql = f"""SELECT k.i, c.osm_id, c.dist, c.tag, c.wkid
+              FROM (SELECT i, ST_SetSRID(ST_MakePoint(x, y), 3857) geom
+                    FROM unnest($1::int[], $2::float8[], $3::float8[]) AS u(i, x, y)) k
+              CROSS JOIN LATERAL ({nearest_sql('k.geom', f'{tag_column(legacy)} tag', '$4', '$5', knn)}) c
+              ORDER BY k.i, c.dist"""
+
+    def flush(res, is_linked):
+        if is_linked:
+            pair_writer.put_many(res)
+        else:
+            single_writer.put_many(res)
+        stageMetrics.count('rows_out', len(res))
+
+    current = None
+    is_linked = False
+    res = []
+    stageMetrics.count('db_queries')
+    async with conn.transaction():
+        async for record in conn.cursor(sql, list(range(len(block))), [p[0] for _, p, _ in block], [p[1] for _, p, _ in block], threshold, limit):
+            # rows arrive grouped by entity, write every entity once all its candidates are read
+            if record['i'] != current:
+                if res:
+                    flush(res, is_linked)
+                current = record['i']
+                is_linked = False
+                res = []
+            wiki_id, _, data = block[current]
+            id = record['wkid']
+            if DATA_SOURCE == 'dbpedia':
+                id = id[3:].replace(' ', '_')
+            match = id == wiki_id
+            is_linked = is_linked or match
+            # legacy files mark every candidate after the linked one as match
+            res.append([wiki_id, record['osm_id'], is_linked if legacy else match, record['dist'], format_tags(record['tag'], legacy)] + data)
+    if res:
+        flush(res, is_linked)
 
 
-async def fetch_candidates_for_name(conn, wiki_id, name, data, pair_queue, single_queue=None, limit=100):
-    sql = f"""SELECT osm_id, (similarity(lower(g."name"), lower($1))) as sim, jsonb_strip_nulls(to_jsonb(g)), wkid
+async def fetch_candidates_for_name(conn, wiki_id, name, data, pair_writer, single_writer=None, limit=100):
+    # % and <-> use the trigram index created with the view, names below the similarity floor are skipped
+    sql = f"""SELECT osm_id, (similarity(lower(g."name"), lower($1))) as sim, tag_text, wkid
               FROM {VIEW_NAME} g
-              WHERE g.name is not null
-              ORDER BY sim DESC LIMIT $2"""
+              WHERE g.name is not null AND lower(g."name") % lower($1)
+              ORDER BY lower(g."name") <-> lower($1) LIMIT $2"""
 
     is_linked = False
     res = []
+    stageMetrics.count('db_queries')
     async with conn.transaction():
         async for record in conn.cursor(sql, name, limit):
             match = False
@@ -127,71 +203,208 @@ async def fetch_candidates_for_name(conn, wiki_id, name, data, pair_queue, singl
             if id == wiki_id:
                 is_linked = True
                 match = True
-            res.append([wiki_id, record['osm_id'], match, record['sim'], filter_tags_concat(record['jsonb_strip_nulls'])] + data)
+            res.append([wiki_id, record['osm_id'], match, record['sim'], record['tag_text']] + data)
 
     if is_linked:
-        for entry in res:
-            pair_queue.put(entry)
+        pair_writer.put_many(res)
     else:
-        for entry in res:
-            single_queue.put(entry)
+        single_writer.put_many(res)
+    stageMetrics.count('rows_out', len(res))
 
 
-async def fetch_candidates_legacy(conn, wiki_id, location, data, pair_queue, single_queue=None, threshold=2500, limit=100):
-    sql = f"""SELECT osm_id, ST_DISTANCE(way, ST_Transform(ST_GeomFromEWKT($1), 3857)) dist, jsonb_strip_nulls(to_jsonb(g)), wkid
-              FROM {VIEW_NAME} g
-              WHERE ST_DWithin(way, ST_Transform(ST_GeomFromEWKT($2), 3857), $3)
-              ORDER BY dist ASC LIMIT $4"""
+async def fetch_candidates_legacy(conn, wiki_id, point, data, pair_writer, single_writer=None, threshold=2500, limit=100, knn=False):
+    sql = nearest_sql('ST_SetSRID(ST_MakePoint($1, $2), 3857)', 'tag_json', '$3', '$4', knn)
 
     is_linked = False
     res = []
+    stageMetrics.count('db_queries')
     async with conn.transaction():
-        async for record in conn.cursor(sql, f'SRID=4326; {location}', f'SRID=4326; {location}', threshold, limit):
+        async for record in conn.cursor(sql, point[0], point[1], threshold, limit):
             id = record['wkid']
             if DATA_SOURCE == 'dbpedia':
                 id = id[3:].replace(' ', '_')
             if id == wiki_id:
                 is_linked = True
-            res.append([wiki_id, record['osm_id'], is_linked, record['dist'], filter_tags_json(record['jsonb_strip_nulls'])] + data)
+            res.append([wiki_id, record['osm_id'], is_linked, record['dist'], format_tags(record['tag_json'], True)] + data)
 
     if is_linked:
-        for entry in res:
-            pair_queue.put(entry)
+        pair_writer.put_many(res)
     else:
-        for entry in res:
-            single_queue.put(entry)
+        single_writer.put_many(res)
+    stageMetrics.count('rows_out', len(res))
+
+
+async def export_view(legacy=False, named_only=False) -> tuple:
+    """
+    read all osm entities of the view once into arrays
+    :param legacy: keep tags as json for legacy embeddings
+    :param named_only: skip osm entities without name
+    :return: tuple of osm ids, x and y coordinates (EPSG:3857), tags, linked kg ids and names
+    """
+    sql = f"""SELECT osm_id, ST_X(way) x, ST_Y(way) y, {tag_column(legacy)} tag, wkid, g."name" FROM {VIEW_NAME} g"""
+    if named_only:
+        sql += ' WHERE g."name" IS NOT NULL'
+    osm_ids, x, y, tags, wkids, names = [], [], [], [], [], []
+    pool = await resources.get_pool(config)
+    async with pool.acquire() as conn, conn.transaction():
+        stageMetrics.count('db_queries')
+        async for record in conn.cursor(sql, prefetch=FETCH_SIZE):
+            id = record['wkid']
+            if DATA_SOURCE == 'dbpedia' and id is not None:
+                id = id[3:].replace(' ', '_')
+            osm_ids.append(record['osm_id'])
+            x.append(record['x'])
+            y.append(record['y'])
+            tags.append(format_tags(record['tag'], legacy))
+            wkids.append(id)
+            names.append(record['name'])
+    return (np.array(osm_ids), np.array(x, dtype=np.float64), np.array(y, dtype=np.float64), np.array(tags, dtype=object),
+            np.array(wkids, dtype=object), names)
+
+
+def generate_in_memory(entities, total: int, osm: tuple, pair_writer, single_writer=None, threshold=2500, limit=100, legacy=False, block_size=10000) -> None:
+    """
+    distance candidates from a kd-tree over the exported view instead of one database query per entity
+    writes the same rows as fetch_candidates_for_point (fetch_candidates_legacy for legacy)
+    :param entities: iterable of (wiki id, (x, y), data) tuples
+    :param total: number of entities for the progress bar
+    :param osm: arrays returned by export_view
+    :param pair_writer: writer for candidates of entities with a linked osm entity
+    :param single_writer: writer for candidates of entities without linked osm entity
+    :param threshold: maximum distance in meters
+    :param limit: maximum number of candidates per entity
+    :param legacy: mark every candidate after the linked one as match like the legacy files
+    :param block_size: number of entities queried at once
+    :return:
+    """
+    osm_ids, x, y, tags, wkids, _ = osm
+    if len(osm_ids) == 0:
+        return
+    tree = cKDTree(np.column_stack([x, y]))
+    # ST_DWithin includes the threshold, the kd-tree bound excludes it
+    bound = np.nextafter(threshold, np.inf)
+    with tqdm(total=total, desc='- Finding candidates') as pbar:
+        for block in iter(lambda: list(itertools.islice(entities, block_size)), []):
+            points = np.array([point for _, point, _ in block])
+            # all points of the block at once, spread over all cores
+            dist, idx = tree.query(points, k=limit, distance_upper_bound=bound, workers=-1)
+            dist, idx = dist.reshape(len(block), -1), idx.reshape(len(block), -1)
+            for j, (wiki_id, _, data) in enumerate(block):
+                found = idx[j] < len(osm_ids)  # missing neighbours are marked with the number of points
+                candidates = idx[j][found]
+                match = wkids[candidates] == wiki_id
+                is_linked = bool(match.any())
+                if legacy:
+                    match = np.logical_or.accumulate(match)
+                res = [[wiki_id, o, m, d, t] + data for o, m, d, t in
+                       zip(osm_ids[candidates].tolist(), match.tolist(), dist[j][found].tolist(), tags[candidates])]
+                if is_linked:
+                    pair_writer.put_many(res)
+                else:
+                    single_writer.put_many(res)
+                stageMetrics.count('rows_out', len(res))
+            pbar.update(len(block))
+
+
+def generate_by_name(entities, total: int, osm: tuple, pair_writer, single_writer=None, limit=100, min_similarity=0.3, tile_size=0, block_size=1000) -> None:
+    """
+    name candidates from a trigram index over the exported view instead of one similarity query per entity
+    writes the same rows as fetch_candidates_for_name
+    :param entities: iterable of (wiki id, name, (x, y), data) tuples
+    :param total: number of entities for the progress bar
+    :param osm: arrays returned by export_view
+    :param pair_writer: writer for candidates of entities with a linked osm entity
+    :param single_writer: writer for candidates of entities without linked osm entity
+    :param limit: maximum number of candidates per entity
+    :param min_similarity: minimum trigram similarity of the names
+    :param tile_size: only consider osm entities in the same or a neighbouring tile of this size in meters, 0 to search everywhere
+    :param block_size: number of entities queried at once
+    :return:
+    """
+    osm_ids, x, y, tags, wkids, names = osm
+    index = nameIndex.TrigramIndex(names)
+    if tile_size > 0:
+        osm_tiles = np.column_stack([x // tile_size, y // tile_size])
+    with tqdm(total=total, desc='- Finding candidates') as pbar:
+        for block in iter(lambda: list(itertools.islice(entities, block_size)), []):
+            allowed = None
+            if tile_size > 0:
+                tiles = np.array([point for _, _, point, _ in block]) // tile_size
+
+                def allowed(i, positions):
+                    return np.all(np.abs(osm_tiles[positions] - tiles[i]) <= 1, axis=1)
+
+            found = index.query([name for _, name, _, _ in block], limit, min_similarity, allowed)
+            for (wiki_id, _, _, data), (candidates, similarity) in zip(block, found):
+                match = wkids[candidates] == wiki_id
+                res = [[wiki_id, o, m, s, t] + data for o, m, s, t in
+                       zip(osm_ids[candidates].tolist(), match.tolist(), similarity.tolist(), tags[candidates])]
+                if match.any():
+                    pair_writer.put_many(res)
+                else:
+                    single_writer.put_many(res)
+                stageMetrics.count('rows_out', len(res))
+            pbar.update(len(block))
+
+
+async def set_similarity_floor(conn) -> None:
+    # threshold of the % operator, reset when the connection is released to the pool
+    await conn.execute("SELECT set_config('pg_trgm.similarity_threshold', $1, false)", str(MIN_SIMILARITY))
+
+
+async def run_jobs(jobs, total: int, workers: int, setup=None) -> None:
+    """
+    run candidate queries on a bounded number of pooled connections
+    jobs are taken from the iterable only when a worker is free, so pending work stays bounded
+    :param jobs: iterable of (coroutine function, arguments after the connection, number of entities)
+    :param total: number of entities for the progress bar
+    :param workers: number of concurrent queries
+    :param setup: coroutine function called with every connection before its first job
+    :return:
+    """
+    pool = await resources.get_pool(config)
+    queue = asyncio.Queue(maxsize=2 * workers)
+    errors = []
+
+    async def worker():
+        try:
+            async with pool.acquire() as conn:
+                if setup is not None:
+                    await setup(conn)
+                while True:
+                    job = await queue.get()
+                    if job is None:
+                        return
+                    fetch, args, size = job
+                    await fetch(conn, *args)
+                    pbar.update(size)
+        except Exception as e:
+            errors.append(e)
+            # keep consuming so the producer never blocks on a full queue
+            while await queue.get() is not None:
+                pass
+
+    with tqdm(total=total, desc='- Finding candidates') as pbar:
+        tasks = [asyncio.ensure_future(worker()) for _ in range(workers)]
+        for job in jobs:
+            if errors:
+                break
+            await queue.put(job)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    if errors:
+        raise errors[0]
 
 
 async def main():
-    conn = await asyncpg.connect(
-        user=PG_USER, 
-        password=password, 
-        database=PG_DB_NAME, 
-        host=PG_HOST, 
-        port=PG_PORT
-    )
-
     with open(LOG_FILENAME, 'w', encoding='utf-8') as file:
         file.write('Starting candidate search\n')
         file.write(f'Matched entities written to: {MATCH_FILENAME}\n')
         file.write(f'Unmatched entities written to: {NO_MATCH_FILENAME}\n')
 
-    match_queue = Queue()
-    single_queue = Queue()
-    stop_threads = False
-
     start_time = time.time()
 
-    print('- Starting file writing threads')
-
-    with open(LOG_FILENAME, 'a', encoding='utf-8') as file:
-        file.write('Starting consumer threads\n')
-
-    match_consumer = Thread(target=consume, daemon=True, args=(lambda: stop_threads, match_queue, MATCH_FILENAME))
-    match_consumer.start()
-    single_consumer = Thread(target=consume, daemon=True, args=(lambda: stop_threads, single_queue, NO_MATCH_FILENAME))
-    single_consumer.start()
-
     with open(LOG_FILENAME, 'a', encoding='utf-8') as file:
         file.write('Starting candidate generation threads\n')
 
@@ -200,51 +413,88 @@ async def main():
     if USE_LEGACY_EMBEDDINGS:
         print('- Loading with JSON data for legacy embeddings')
 
-    tasks = []
-
     if not USE_LEGACY_EMBEDDINGS:
-        if GENERATION_METHOD == 'distance':
+        if GENERATION_METHOD in ['distance', 'knn', 'memory']:
             col_mask = [c not in ['wkid', 'location'] for c in wiki_data.columns]
             header_names = ['wkid', 'osm_id', 'match', 'dist', 'tags'] + list(wiki_data.columns[col_mask])
-            match_queue.put(header_names)
-            single_queue.put(header_names)
-            for index, row in wiki_data.iterrows():
-                tasks.append(fetch_candidates_for_point(conn, row['wkid'], row['location'], list(row[col_mask]), match_queue, single_queue, DIST_THRESHOLD, MAX_CANDIDATES))
-        else:  # GENERATION_METHOD == 'name':
+        else:  # GENERATION_METHOD in ['name', 'ngram']:
             col_mask = [c not in ['wkid', 'name'] for c in wiki_data.columns]
             header_names = ['wkid', 'osm_id', 'match', 'sim', 'tags'] + list(wiki_data.columns[col_mask])
-            match_queue.put(header_names)
-            single_queue.put(header_names)
-            for index, row in wiki_data.iterrows():
-                tasks.append(fetch_candidates_for_name(conn, row['wkid'], row['name'], list(row[col_mask]), match_queue, single_queue, MAX_CANDIDATES))
     else:
         col_mask = [c not in ['wkid', 'location', 'name'] for c in wiki_data.columns]
         header_names = ['wkid', 'osm_id', 'match', 'dist', 'tags'] + list(wiki_data.columns[col_mask])
-        match_queue.put(header_names)
-        single_queue.put(header_names)
-        for index, row in wiki_data.iterrows():
-            tasks.append(fetch_candidates_legacy(conn, row['wkid'], row['location'], list(row[col_mask]), match_queue, single_queue, DIST_THRESHOLD, MAX_CANDIDATES))
 
-    for f in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc='- Finding candidates'):
-        await f
+    print('- Starting file writing threads')
+
+    with open(LOG_FILENAME, 'a', encoding='utf-8') as file:
+        file.write('Starting consumer threads\n')
+
+    store = None
+    if USE_LEGACY_EMBEDDINGS:
+        match_writer = BatchWriter(MATCH_FILENAME, QUEUE_SIZE, BATCH_SIZE)
+        single_writer = BatchWriter(NO_MATCH_FILENAME, QUEUE_SIZE, BATCH_SIZE)
+        match_writer.put(header_names)
+        single_writer.put(header_names)
+    else:
+        # pairs, kg entities and osm entities in separate tables
+        store = candidateStore.CandidateStore(DATA_DIR, header_names[3], header_names[5:])
+        match_writer = store.writer('train')
+        single_writer = store.writer('unmatched')
+
+    # entities are streamed from the dataframe instead of creating every query up front
+    by_name = GENERATION_METHOD == 'name' and not USE_LEGACY_EMBEDDINGS
+    knn = GENERATION_METHOD == 'knn'
+    if by_name:
+        entities = ((row['wkid'], row['name'], list(row[col_mask])) for index, row in wiki_data.iterrows())
+    else:
+        entities = ((row['wkid'], point, list(row[col_mask])) for (index, row), point in zip(wiki_data.iterrows(), zip(wiki_x, wiki_y)))
+    if GENERATION_METHOD == 'ngram' and not USE_LEGACY_EMBEDDINGS:
+        osm = await export_view(named_only=True)
+        print(f'- Indexing names of {len(osm[0])} osm entities')
+        entities = ((row['wkid'], row['name'], point, list(row[col_mask])) for (index, row), point in zip(wiki_data.iterrows(), zip(wiki_x, wiki_y)))
+        generate_by_name(entities, len(wiki_data), osm, match_writer, single_writer, MAX_CANDIDATES, MIN_SIMILARITY,
+                         NAME_TILE_SIZE, BLOCK_SIZE if BLOCK_SIZE > 0 else 1000)
+    elif GENERATION_METHOD == 'memory':
+        osm = await export_view(USE_LEGACY_EMBEDDINGS)
+        print(f'- Searching {len(osm[0])} osm entities in memory')
+        generate_in_memory(entities, len(wiki_data), osm, match_writer, single_writer, DIST_THRESHOLD, MAX_CANDIDATES,
+                           USE_LEGACY_EMBEDDINGS, BLOCK_SIZE if BLOCK_SIZE > 0 else 10000)
+    else:
+        if by_name:
+            jobs = ((fetch_candidates_for_name, (wiki_id, name, data, match_writer, single_writer, MAX_CANDIDATES), 1)
+                    for wiki_id, name, data in entities)
+        elif BLOCK_SIZE > 0:
+            # one query per block of entities
+            print(f'- Querying blocks of {BLOCK_SIZE} entities')
+            blocks = iter(lambda: list(itertools.islice(entities, BLOCK_SIZE)), [])
+            jobs = ((fetch_candidates_for_block, (block, match_writer, single_writer, DIST_THRESHOLD, MAX_CANDIDATES, USE_LEGACY_EMBEDDINGS, knn), len(block))
+                    for block in blocks)
+        elif USE_LEGACY_EMBEDDINGS:
+            jobs = ((fetch_candidates_legacy, (wiki_id, point, data, match_writer, single_writer, DIST_THRESHOLD, MAX_CANDIDATES, knn), 1)
+                    for wiki_id, point, data in entities)
+        else:
+            jobs = ((fetch_candidates_for_point, (wiki_id, point, data, match_writer, single_writer, DIST_THRESHOLD, MAX_CANDIDATES, knn), 1)
+                    for wiki_id, point, data in entities)
+
+        print(f'- Running {WORKERS} concurrent queries')
+        await run_jobs(jobs, len(wiki_data), WORKERS, set_similarity_floor if by_name else None)
 
     with open(LOG_FILENAME, 'a', encoding='utf-8') as file:
         file.write('Finished candidate generation threads\n')
 
-    stop_threads = True
-    match_consumer.join()
-    single_consumer.join()
+    if store is not None:
+        store.close()
+    else:
+        match_writer.close()
+        single_writer.close()
 
     with open(LOG_FILENAME, 'a', encoding='utf-8') as file:
         file.write('Stopped consumer threads\n')
 
-    await conn.close()
-
     with open(LOG_FILENAME, 'a', encoding='utf-8') as file:
-        file.write('Closed connection\n')
         file.write(f"Execution ended successfully at {time.strftime('%d.%M.%Y %H:%M:%S', time.gmtime(time.time()))}\n")
         file.write(f"Execution time: {time.strftime('%H:%M:%S', time.gmtime(time.time() - start_time))}\n")
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    resources.run(main())
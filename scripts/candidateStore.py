@@ -0,0 +1,173 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PAIR_FILES = {'train': 'train pairs.parquet', 'unmatched': 'unmatched pairs.parquet'}
+KG_FILE = 'kg entities.parquet'
+OSM_FILE = 'osm entities.parquet'
+
+
+class PairWriter:
+    """
+    Writer for the pair table of a single candidate set
+    Takes the same rows as BatchWriter ([wkid, osm_id, match, score, tags] + kg columns). Only wkid,
+    osm_id, match and score are written to the pair table, entity columns go to the side tables of the store.
+    """
+    def __init__(self, store, path: str, batch_size: int):
+        self.store = store
+        self.batch_size = batch_size
+        self.schema = pa.schema([('wkid', pa.string()), ('osm_id', pa.int64()), ('match', pa.bool_()), (store.score_column, pa.float64())])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.columns = [[], [], [], []]
+
+    def put_many(self, rows: list) -> None:
+        """
+        hand over the candidate rows of an entity
+        :param rows: list of rows
+        :return:
+        """
+        for row in rows:
+            for column, value in zip(self.columns, row):
+                column.append(value)
+            self.store.osm.setdefault(row[1], row[4])
+            self.store.kg.setdefault(row[0], row[5:])
+        if len(self.columns[0]) >= self.batch_size:
+            self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        self.writer.close()
+
+    def _flush(self) -> None:
+        if self.columns[0]:
+            self.writer.write_table(pa.Table.from_arrays(self.columns, schema=self.schema))
+            self.columns = [[], [], [], []]
+
+
+class CandidateStore:
+    """
+    Normalized candidate pairs of an iteration
+    Every candidate set (train, unmatched) is a narrow table of wkid, osm_id, match and score (dist or
+    sim). Kg entity columns and osm tags are kept once per entity in side tables shared by all sets
+    and gathered per pair on access through load_pairs.
+    """
+    def __init__(self, data_dir: str, score_column: str, kg_columns: list, batch_size: int = 100000):
+        """
+        :param data_dir: folder of the iteration
+        :param score_column: name of the score column, dist or sim
+        :param kg_columns: names of the kg entity columns following the tags in the rows
+        :param batch_size: number of pairs per row group
+        """
+        self.data_dir = data_dir
+        self.score_column = score_column
+        self.kg_columns = kg_columns
+        self.batch_size = batch_size
+        self.kg = {}
+        self.osm = {}
+        self.writers = []
+
+    def writer(self, name: str) -> PairWriter:
+        """
+        writer for a candidate set
+        :param name: train or unmatched
+        :return: PairWriter
+        """
+        writer = PairWriter(self, os.path.join(self.data_dir, PAIR_FILES[name]), self.batch_size)
+        self.writers.append(writer)
+        return writer
+
+    def close(self) -> None:
+        """
+        finish all pair tables and write the entity tables
+        :return:
+        """
+        for writer in self.writers:
+            writer.close()
+        kg_values = list(zip(*self.kg.values())) if self.kg else [[] for _ in self.kg_columns]
+        kg = pa.Table.from_arrays([pa.array(list(self.kg.keys()), pa.string())] + [pa.array(list(v), from_pandas=True) for v in kg_values],
+                                  names=['wkid'] + list(self.kg_columns))
+        pq.write_table(kg, os.path.join(self.data_dir, KG_FILE))
+        osm = pa.Table.from_arrays([pa.array(list(self.osm.keys()), pa.int64()), pa.array(list(self.osm.values()), pa.string())],
+                                   names=['osm_id', 'tags'])
+        pq.write_table(osm, os.path.join(self.data_dir, OSM_FILE))
+
+
+class CandidatePairs:
+    """
+    Candidate pairs of a candidate set with lazy access to their entity columns
+    The narrow pair table is read once. Entity columns (tags and kg columns) stay in the memory mapped
+    side tables and are only gathered per pair for the columns a stage asks for. Stages working on
+    distinct entities can use the side table values and the row of every pair directly (see entities).
+    """
+    def __init__(self, data_dir: str, name: str):
+        """
+        :param data_dir: folder of the iteration
+        :param name: train or unmatched
+        """
+        self.pairs = pq.read_table(os.path.join(data_dir, PAIR_FILES[name]), memory_map=True).to_pandas()
+        self.osm = pq.read_table(os.path.join(data_dir, OSM_FILE), memory_map=True)
+        self.kg = pq.read_table(os.path.join(data_dir, KG_FILE), memory_map=True)
+        self._rows = {}
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    @property
+    def entity_columns(self) -> list:
+        """
+        :return: names of the entity columns in the order of the candidate tsv files, tags followed by kg columns
+        """
+        return ['tags'] + [c for c in self.kg.column_names if c != 'wkid']
+
+    @property
+    def columns(self) -> list:
+        return list(self.pairs.columns) + self.entity_columns
+
+    def entities(self, column: str) -> tuple:
+        """
+        values of an entity column once per entity
+        :param column: tags or a kg column
+        :return: tuple of the values (pandas series) and the position of the entity of every pair in them
+        """
+        table, key = (self.osm, 'osm_id') if column == 'tags' else (self.kg, 'wkid')
+        if key not in self._rows:
+            rows = pd.Index(table.column(key).to_pandas()).get_indexer(self.pairs[key])
+            if (rows < 0).any():
+                raise KeyError(f'{int((rows < 0).sum())} candidate pairs without {key} in the entity table')
+            self._rows[key] = rows
+        return table.column(column).to_pandas(), self._rows[key]
+
+    def __getitem__(self, column: str) -> pd.Series:
+        """
+        column of all pairs, entity columns are gathered from the side tables
+        :param column: pair or entity column
+        :return: series aligned with the pairs
+        """
+        if column in self.pairs.columns:
+            return self.pairs[column]
+        values, rows = self.entities(column)
+        return pd.Series(values.to_numpy()[rows], index=self.pairs.index, name=column)
+
+    def frame(self, columns: list = None) -> pd.DataFrame:
+        """
+        pairs joined with their entity columns
+        columns are in the order of the candidate tsv files: wkid, osm_id, match, score, tags and kg columns
+        :param columns: entity columns to include, None for all
+        :return: dataframe with one row per pair
+        """
+        data = self.pairs.copy()
+        for column in self.entity_columns:
+            if columns is None or column in columns:
+                data[column] = self[column]
+        return data
+
+
+def load_pairs(data_dir: str, name: str) -> CandidatePairs:
+    """
+    candidate pairs of a candidate set, their entity columns are read on access
+    :param data_dir: folder of the iteration
+    :param name: train or unmatched
+    :return: CandidatePairs
+    """
+    return CandidatePairs(data_dir, name)
@@ -1,9 +1,15 @@
 import pandas as pd
 import numpy as np
 import fasttext
+import resources
+import stageMetrics
+import candidateStore
+import embeddingCache
+import embeddingStore
+import fasttextVectors
+import os
 import sys
 import configparser
-import warnings
 
 DATA_DIR = sys.argv[1]
 CONFIG_PATH = sys.argv[2]
@@ -11,13 +17,15 @@ CONFIG_PATH = sys.argv[2]
 config = configparser.ConfigParser()
 config.read(CONFIG_PATH)
 
-DATASET_LOCATION = DATA_DIR + 'train pairs.tsv'  # path to data file to embed (in tsv format)
-PREDICTSET_LOCATION = DATA_DIR + 'unmatched pairs.tsv'
 OUTPUT_PATH_TRAIN = DATA_DIR + 'el training set.parquet'  # file path for resulting file
 OUTPUT_PATH_PREDICTIONS = DATA_DIR + 'el prediction set.parquet'
 OUTPUT_FORMAT = 'parquet'
 FT_PATH = config.get('fasttext', 'location')
 SCRAPE_MODES = [s.strip() for s in config.get('wikidata scrape', 'scrape_values').split(',')]
+EMBEDDING_CACHE = resources.get_embedding_cache(config)
+MODEL_KEY = embeddingCache.model_key(FT_PATH)
+WORKERS = config.getint('fasttext', 'workers', fallback=1)
+VECTORS_PATH = config.get('fasttext', 'vectors_location', fallback='').strip() or os.path.splitext(FT_PATH)[0] + ' vectors'
 
 
 def embed_list(labels: list, model: fasttext.FastText) -> np.ndarray:
@@ -56,45 +64,58 @@ def embed_tags(tags: str, model: fasttext.FastText) -> np.ndarray:
     # string will be split on spaces and mean pooled for sentences
     return model.get_word_vector(tags) if tags else np.zeros(300)
 
-def compute_embeddings(input_path: str) -> pd.DataFrame:
-    print('-reading datafile')
-    print(f'-from: {input_path}')
 
-    data = pd.read_csv(input_path, delimiter='\t')
+def encode(texts: list) -> np.ndarray:
+    """
+    encode strings with the fasttext model, in parallel if worker processes are configured
+    :param texts: strings to encode
+    :return: matrix with one 300 dimensional encoding per string
+    """
+    if encoder is not None:
+        return encoder.encode(texts)
+    return np.array([embed_tags(text, ft_model) for text in texts], dtype=np.float32).reshape(-1, 300)
 
-    # strategy: just embed what there is
-    columns = list(data.columns)
-    drop_list = []
 
-    if 'type' in columns:
-        types = data['type'].unique()
-        types_dict = {types[code]:code  for code in range(len(types))} # create dictionary of types
-        data['type'] = data['type'].apply(lambda x: types_dict[x])
+def embed_unique(values: pd.Series, kind: str) -> np.ndarray:
+    """
+    embed every distinct string of a column once and broadcast the vectors to its rows
+    labels and properties repeat for all candidates of a kg entity, tags for all kg entities near an osm entity
+    :param values: column of strings
+    :param kind: kind of encoding, labels are ; separated lists (see embed_list), everything else text (see embed_tags)
+    :return: matrix with one 300 dimensional encoding per row
+    """
+    codes, uniques = pd.factorize(values)
+    keys = [embeddingCache.string_key(value) for value in uniques]
+    cached = EMBEDDING_CACHE.get_many(MODEL_KEY, kind, keys)
+    vectors = np.empty((len(uniques), 300), dtype=np.float32)
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    for i, key in enumerate(keys):
+        if key in cached:
+            vectors[i] = cached[key]
+    texts = [' '.join(uniques[i].split(';')) if kind == 'labels' else uniques[i] for i in missing]
+    vectors[missing] = encode(texts)
+    computed = {keys[i]: vectors[i] for i in missing}
+    EMBEDDING_CACHE.put_many(MODEL_KEY, kind, computed)
+    stageMetrics.count('embedded_strings', len(computed))
+    return vectors[codes]
+
+
+def compute_embeddings(name: str) -> tuple:
+    """
+    embed the candidate pairs of a candidate set
+    :param name: train or unmatched
+    :return: tuple of the pairs without text columns and their feature matrix
+    """
+    print('-reading candidate pairs')
+    print(f'-from: {DATA_DIR + candidateStore.PAIR_FILES[name]}')
 
+    pairs = candidateStore.load_pairs(DATA_DIR, name)
+    stageMetrics.count('rows_in', len(pairs))
 
-    # compute embeddings for wikidata type labels
-    if 'labels' in columns:
-        drop_list.append('labels')
-        print('-embedding wikidata labels')
-        data['labels'].fillna('', inplace=True)
-        data = pd.concat([data, data.apply(lambda x: embed_list(str(x['labels']).split(';'), ft_model), axis=1, result_type='expand').
-                         rename(columns={i: f'l_emb_{i}' for i in range(300)})], axis=1)
-
-    # compute embeddings for osm tags
-    if 'tags' in columns:
-        drop_list.append('tags')
-        print('-embedding osm tags')
-        data['tags'].fillna('', inplace=True)
-        data = pd.concat([data, data.apply(lambda x: embed_tags(x['tags'], ft_model), axis=1, result_type='expand').
-                         rename(columns={i: f't_emb_{i}' for i in range(300)})], axis=1)
-
-    # compute embeddings for osm tags
-    if 'properties' in columns:
-        drop_list.append('properties')
-        print('-embedding wikidata properties')
-        data['properties'].fillna('', inplace=True)
-        data = pd.concat([data, data.apply(lambda x: embed_tags(x['properties'], ft_model), axis=1, result_type='expand').
-                         rename(columns={i: f'p_emb_{i}' for i in range(300)})], axis=1)
+    # strategy: just embed what there is
+    columns = pairs.columns
+    embedded = [(column, kind) for column, kind in [('labels', 'labels'), ('tags', 'text'), ('properties', 'text')] if column in columns]
+    drop_list = [column for column, _ in embedded]
 
     # usually shouldn't be here and not used for entityLinking now
     # name sim will be used
@@ -105,28 +126,61 @@ def compute_embeddings(input_path: str) -> pd.DataFrame:
     if 'location' in columns:
         drop_list.append('location')
 
-    if drop_list:
-        data = data.drop(columns=drop_list, axis=1)
-    return data
-
+    data = pairs.frame([c for c in pairs.entity_columns if c not in drop_list])
+    if 'type' in columns:
+        types = data['type'].unique()
+        types_dict = {types[code]:code  for code in range(len(types))} # create dictionary of types
+        data['type'] = data['type'].apply(lambda x: types_dict[x])
 
-def write_data(data: pd.DataFrame, output_path: str) -> None:
+    # features in one float32 matrix: the scalar columns after wkid, osm_id and match followed by the encodings,
+    # so training and prediction can use the memory mapped file as it is
+    scalars = data.shape[1] - 3
+    matrix = np.empty((len(pairs), scalars + 300 * len(embedded)), dtype=np.float32)
+    matrix[:, :scalars] = data.iloc[:, 3:].to_numpy(dtype=np.float32)
+    # text columns are embedded once per entity of the side tables and gathered per pair
+    for i, (column, kind) in enumerate(embedded):
+        print(f'-embedding {column}')
+        values, rows = pairs.entities(column)
+        # side tables are shared by train and unmatched pairs, only entities of this set are embedded
+        used, rows = np.unique(rows, return_inverse=True)
+        start = scalars + i * 300
+        matrix[:, start:start + 300] = embed_unique(values.iloc[used].fillna('').astype(str), kind)[rows]
+    return data, matrix
+
+
+def write_data(data: pd.DataFrame, matrix: np.ndarray, output_path: str) -> None:
     print('-writing transformed dataset')
     print(f'-writing to: {output_path}')
     data.to_parquet(output_path, engine='pyarrow')
+    embeddingStore.write_matrix(output_path, matrix)
+    stageMetrics.count('rows_out', len(data))
+    resources.publish(output_path, data)
     print('-writing complete')
 
 
 print('embedding data')
 
-print('-loading fasttext model')
-print(f'-from: {FT_PATH}')
-with warnings.catch_warnings():
-    warnings.simplefilter('ignore')  # supress warning about change of model class
-    ft_model = fasttext.load_model(FT_PATH)
-
-df = compute_embeddings(DATASET_LOCATION)
-write_data(df, OUTPUT_PATH_TRAIN)
-
-df = compute_embeddings(PREDICTSET_LOCATION)
-write_data(df, OUTPUT_PATH_PREDICTIONS)
+encoder = None
+ft_model = None
+if WORKERS > 1 and fasttextVectors.can_fork():
+    # workers share the vectors through memory mapped files instead of loading the model each
+    if not fasttextVectors.is_exported(VECTORS_PATH, FT_PATH):
+        print(f'-exporting fasttext vectors of {FT_PATH}')
+        print(f'-to: {VECTORS_PATH}')
+        fasttextVectors.export_model(resources.load_fasttext(FT_PATH), FT_PATH, VECTORS_PATH)
+    print(f'-encoding with {WORKERS} worker processes')
+    encoder = fasttextVectors.ParallelEncoder(VECTORS_PATH, WORKERS)
+else:
+    print('-loading fasttext model')
+    print(f'-from: {FT_PATH}')
+    ft_model = resources.load_fasttext(FT_PATH)
+
+try:
+    df, embeddings = compute_embeddings('train')
+    write_data(df, embeddings, OUTPUT_PATH_TRAIN)
+
+    df, embeddings = compute_embeddings('unmatched')
+    write_data(df, embeddings, OUTPUT_PATH_PREDICTIONS)
+finally:
+    if encoder is not None:
+        encoder.close()
@@ -0,0 +1,278 @@
+import os
+import re
+import bz2
+import glob
+import gzip
+import json
+import sqlite3
+from tqdm import tqdm
+import resources
+import sparqlClient
+
+CHUNK_SIZE = 500  # sqlite limits the number of parameters per statement
+INSERT_BATCH = 100000
+
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+DBO = 'http://dbpedia.org/ontology/'
+GEO_LAT = 'http://www.w3.org/2003/01/geo/wgs84_pos#lat'
+GEO_LONG = 'http://www.w3.org/2003/01/geo/wgs84_pos#long'
+
+CLASS_QUERY = """
+PREFIX de: <http://de.dbpedia.org/resource/>
+PREFIX fr: <http://fr.dbpedia.org/resource/>
+PREFIX country: <http://dbpedia.org/resource/>
+PREFIX db: <http://dbpedia.org/resource/>
+PREFIX dbp: <http://dbpedia.org/property/>
+PREFIX dbo: <http://dbpedia.org/ontology/>
+
+SELECT ?item AVG(?lat) as ?lat AVG(?lon) as ?lon WHERE {
+    ?item rdf:type dbo:%s.
+    ?item dbo:country country:%s.
+    ?item geo:lat ?lat.
+    ?item geo:long ?lon
+} group by ?item
+"""
+
+PROPERTY_QUERY = """
+select distinct ?item ?property ?value
+    where {
+        VALUES ?item {%s}
+        ?item ?property ?value.
+    }
+"""
+
+# subject, predicate and object of a single n-triples line
+TRIPLE_PATTERN = re.compile(r'^<([^>]*)>\s+<([^>]*)>\s+(.*?)\s*\.\s*$')
+LITERAL_PATTERN = re.compile(r'^"((?:[^"\\]|\\.)*)"(?:@[\w-]+|\^\^<[^>]*>)?$')
+ESCAPE_PATTERN = re.compile(r'\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)')
+ESCAPES = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+
+def resource_prefix(language: str) -> str:
+    """
+    uri prefix of resources of the dbpedia chapter of the given language
+    :param language: language code, e.g. fr
+    :return: prefix such as http://fr.dbpedia.org/resource/
+    """
+    if language == 'en':
+        return 'http://dbpedia.org/resource/'
+    return f'http://{language}.dbpedia.org/resource/'
+
+
+def _unescape(match) -> str:
+    code = match.group(1)
+    if code[0] in 'uU' and len(code) > 1:
+        return chr(int(code[1:], 16))
+    return ESCAPES.get(code, code)
+
+
+def parse_object(term: str) -> str:
+    """
+    object of a triple in the form returned by sparql (uri or lexical form of the literal)
+    :param term: n-triples object term
+    :return: uri or literal value
+    """
+    if term.startswith('<'):
+        return term[1:-1]
+    literal = LITERAL_PATTERN.match(term)
+    if literal:
+        return ESCAPE_PATTERN.sub(_unescape, literal.group(1))
+    return term  # blank node
+
+
+class SparqlBackend:
+    """
+    Answers the dbpedia questions of the experiment with queries to the sparql endpoint of each chapter
+    Results are cached in the kg cache (see kgCache.py), only missing entities are queried.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.client = resources.get_sparql_client(config)
+        self.cache = resources.get_kg_cache(config)
+
+    def class_members(self, language: str, country: str, classes: list):
+        """
+        entities with coordinates located in the country per class
+        :param language: dbpedia chapter
+        :param country: name of the country resource, e.g. France
+        :param classes: dbpedia ontology classes
+        :return: generator of (class, list of [resource name, location] or None if the query failed) in the order of classes
+        """
+        endpoint = sparqlClient.dbpedia_endpoint(self.config, language)
+        members = self.cache.get_many('dbpedia class members', [f'{language} {country} {c}' for c in classes])
+        missing = [c for c in classes if f'{language} {country} {c}' not in members]
+        results = self.client.query_many(endpoint, [CLASS_QUERY % (c, country) for c in missing])
+        for clazz in classes:
+            key = f'{language} {country} {clazz}'
+            if key not in members:
+                result = next(results)  # results arrive in the order of missing
+                if result is None:
+                    yield clazz, None
+                    continue
+                members[key] = [[res['item']['value'].split('/')[-1], f"Point({res['lon']['value']} {res['lat']['value']})"]
+                                for res in result['results']['bindings']]
+                self.cache.put_many('dbpedia class members', {key: members[key]})
+            yield clazz, members[key]
+
+    def properties(self, language: str, names: list, batch_size: int = 70, timeout: float = None) -> dict:
+        """
+        all property value pairs of resources
+        :param language: dbpedia chapter
+        :param names: resource names (last part of the uri)
+        :param batch_size: number of resources per query
+        :param timeout: request timeout overriding the default
+        :return: dictionary of resource name and list of [property uri, value]
+        """
+        endpoint = sparqlClient.dbpedia_endpoint(self.config, language)
+        prefix = resource_prefix(language)
+        kind = f'dbpedia properties {language}'
+        values = self.cache.get_many(kind, names)
+        missing = [e for e in dict.fromkeys(names) if e not in values]
+        batches = sparqlClient.batches(missing, batch_size)
+        queries = [PROPERTY_QUERY % ' '.join(f'<{prefix}{e}>' for e in batch) for batch in batches]
+        with tqdm(total=len(missing), desc=f'-collecting dbpedia information ({language})') as pbar:
+            for batch, result in zip(batches, self.client.query_many(endpoint, queries, timeout)):
+                if result is None:
+                    pbar.write(f'An error occurred gathering {batch[0]} - {batch[-1]}, skipping...')
+                else:
+                    fetched = {e: [] for e in batch}
+                    for res in result['results']['bindings']:
+                        name = res['item']['value'].split('/')[-1]
+                        fetched.setdefault(name, []).append([res['property']['value'], res['value']['value']])
+                    self.cache.put_many(kind, fetched)
+                    values.update(fetched)
+                pbar.update(len(batch))
+        return values
+
+
+class DumpBackend:
+    """
+    Answers the dbpedia questions of the experiment from local stores built from n-triples dumps
+    Every language has its own folder of dump files (.ttl or .nt in n-triples syntax, optionally bz2
+    or gz compressed, see https://databus.dbpedia.org). All triples about resources of the chapter are
+    loaded into a sqlite store per language, indexed by subject. A store is rebuilt when its dump
+    files change.
+    """
+    def __init__(self, dump_location: str, store_location: str):
+        """
+        :param dump_location: folder of the dump files, {language} is replaced by the language code
+        :param store_location: sqlite file of the store, {language} is replaced by the language code
+        """
+        self.dump_location = dump_location
+        self.store_location = store_location
+        self.stores = {}
+
+    def class_members(self, language: str, country: str, classes: list):
+        conn = self._store(language)
+        if conn is None:
+            for clazz in classes:
+                yield clazz, []
+            return
+        # the country is given as english or as chapter resource depending on the chapter
+        countries = [resource_prefix('en') + country, resource_prefix(language) + country]
+        query = f"""SELECT t.subject, avg(CAST(lat.value AS REAL)), avg(CAST(lon.value AS REAL)) FROM triples t
+                    JOIN triples c ON c.subject = t.subject AND c.property = 'http://dbpedia.org/ontology/country' AND c.value IN (?, ?)
+                    JOIN triples lat ON lat.subject = t.subject AND lat.property = '{GEO_LAT}'
+                    JOIN triples lon ON lon.subject = t.subject AND lon.property = '{GEO_LONG}'
+                    WHERE t.property = '{RDF_TYPE}' AND t.value = ?
+                    GROUP BY t.subject"""
+        for clazz in classes:
+            rows = conn.execute(query, countries + [DBO + clazz]).fetchall()
+            yield clazz, [[name, f'Point({lon} {lat})'] for name, lat, lon in rows]
+
+    def properties(self, language: str, names: list, batch_size: int = 70, timeout: float = None) -> dict:
+        conn = self._store(language)
+        names = list(dict.fromkeys(names))
+        values = {e: [] for e in names}
+        if conn is None:
+            return values
+        for i in range(0, len(names), CHUNK_SIZE):
+            chunk = names[i:i + CHUNK_SIZE]
+            rows = conn.execute(f"SELECT DISTINCT subject, property, value FROM triples WHERE subject IN ({','.join('?' * len(chunk))})", chunk)
+            for name, prop, value in rows:
+                values[name].append([prop, value])
+        return values
+
+    def _store(self, language: str):
+        # None for languages without dump files, their entities have no properties
+        if language not in self.stores:
+            files = sorted(f for pattern in ['*.ttl', '*.nt', '*.ttl.bz2', '*.nt.bz2', '*.ttl.gz', '*.nt.gz']
+                           for f in glob.glob(os.path.join(self.dump_location.format(language=language), pattern)))
+            if not files:
+                print(f'-warning: no dbpedia dump files for language {language} in {self.dump_location.format(language=language)}, skipping')
+                self.stores[language] = None
+                return None
+            store_path = self.store_location.format(language=language)
+            source = json.dumps([[os.path.abspath(f), os.path.getsize(f), os.stat(f).st_mtime_ns] for f in files])
+            if not self._is_current(store_path, source):
+                self._build(language, files, store_path, source)
+            self.stores[language] = sqlite3.connect(store_path)
+        return self.stores[language]
+
+    @staticmethod
+    def _is_current(store_path: str, source: str) -> bool:
+        if not os.path.isfile(store_path):
+            return False
+        with sqlite3.connect(store_path) as conn:
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+            except sqlite3.DatabaseError:
+                return False
+        return row is not None and row[0] == source
+
+    @staticmethod
+    def _build(language: str, files: list, store_path: str, source: str) -> None:
+        print(f'-building dbpedia store {store_path} from {len(files)} dump files')
+        tmp_path = store_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE triples (subject TEXT, property TEXT, value TEXT);
+        """)
+        prefix = resource_prefix(language)
+        rows = []
+        for path in files:
+            if path.endswith('.bz2'):
+                dump = bz2.open(path, 'rt', encoding='utf-8')
+            elif path.endswith('.gz'):
+                dump = gzip.open(path, 'rt', encoding='utf-8')
+            else:
+                dump = open(path, 'r', encoding='utf-8')
+            with dump:
+                for line in tqdm(dump, desc=f'-reading {os.path.basename(path)}', unit=' triples'):
+                    if not line.startswith('<' + prefix):
+                        continue
+                    triple = TRIPLE_PATTERN.match(line)
+                    if triple is None:
+                        continue
+                    rows.append((triple.group(1)[len(prefix):], triple.group(2), parse_object(triple.group(3))))
+                    if len(rows) >= INSERT_BATCH:
+                        conn.executemany('INSERT INTO triples VALUES (?, ?, ?)', rows)
+                        rows = []
+        conn.executemany('INSERT INTO triples VALUES (?, ?, ?)', rows)
+
+        print('-indexing dbpedia store')
+        conn.executescript("""
+            CREATE INDEX triples_subject ON triples (subject);
+            CREATE INDEX triples_property_value ON triples (property, value);
+        """)
+        conn.execute("INSERT INTO meta VALUES ('source', ?)", (source,))
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, store_path)
+
+
+def get_backend(config):
+    """
+    backend selected in the dbpedia scrape config section
+    :param config: parsed experiment config
+    :return: SparqlBackend or DumpBackend
+    """
+    if config.get('dbpedia scrape', 'backend', fallback='sparql') == 'dump':
+        return DumpBackend(config.get('dbpedia scrape', 'dump_location'),
+                           config.get('dbpedia scrape', 'store_location', fallback='./dbpedia {language}.sqlite'))
+    return SparqlBackend(config)
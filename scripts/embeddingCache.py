@@ -0,0 +1,88 @@
+import os
+import hashlib
+import sqlite3
+import numpy as np
+import stageMetrics
+
+# sqlite limits the number of parameters per statement
+_CHUNK_SIZE = 500
+
+
+def string_key(text: str) -> str:
+    """
+    key of a string in the cache
+    :param text: embedded string
+    :return: hex digest of the utf-8 encoded string
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def model_key(model_path: str) -> str:
+    """
+    identity of a model file in the cache, a replaced model file gets a new key
+    :param model_path: location of the fasttext .bin model
+    :return: absolute path, size and modification time of the file
+    """
+    stat = os.stat(model_path)
+    return f'{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+class EmbeddingCache:
+    """
+    On disk cache of fasttext embeddings shared by all stages and iterations
+    Vectors are stored as float32 bytes per model, kind of string (e.g. 'tags') and hash of the string.
+    Without a path nothing is cached.
+    """
+    def __init__(self, path: str = None):
+        """
+        :param path: sqlite file, None or empty to disable caching
+        """
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS vectors (
+                                    model TEXT NOT NULL,
+                                    kind TEXT NOT NULL,
+                                    key TEXT NOT NULL,
+                                    vector BLOB NOT NULL,
+                                    PRIMARY KEY (model, kind, key))""")
+            self.conn.commit()
+
+    def get_many(self, model: str, kind: str, keys: list) -> dict:
+        """
+        look up cached vectors
+        :param model: model_key of the fasttext model the vectors were computed with
+        :param kind: kind of string the vectors belong to
+        :param keys: string keys to look up
+        :return: dictionary of the keys found in the cache and their vectors
+        """
+        found = {}
+        if self.conn is not None:
+            for i in range(0, len(keys), _CHUNK_SIZE):
+                chunk = keys[i:i + _CHUNK_SIZE]
+                rows = self.conn.execute(f"""SELECT key, vector FROM vectors
+                                             WHERE model = ? AND kind = ? AND key IN ({','.join('?' * len(chunk))})""",
+                                         [model, kind] + chunk).fetchall()
+                found.update({key: np.frombuffer(vector, dtype=np.float32) for key, vector in rows})
+        stageMetrics.count('embedding_cache_hits', len(found))
+        stageMetrics.count('embedding_cache_misses', len(keys) - len(found))
+        return found
+
+    def put_many(self, model: str, kind: str, vectors: dict) -> None:
+        """
+        store computed vectors
+        :param model: model_key of the fasttext model the vectors were computed with
+        :param kind: kind of string the vectors belong to
+        :param vectors: dictionary of string keys and vectors
+        :return:
+        """
+        if self.conn is None or not vectors:
+            return
+        self.conn.executemany("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)",
+                              [(model, kind, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()])
+        self.conn.commit()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
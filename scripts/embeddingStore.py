@@ -0,0 +1,32 @@
+import numpy as np
+import resources
+
+
+def matrix_path(dataset_path: str) -> str:
+    """
+    location of the feature matrix belonging to an embedded dataset
+    :param dataset_path: parquet file of the dataset, e.g. el training set.parquet
+    :return: npy file next to it, e.g. el training set embeddings.npy
+    """
+    return dataset_path[:-len('.parquet')] + ' embeddings.npy'
+
+
+def write_matrix(dataset_path: str, matrix: np.ndarray) -> None:
+    """
+    write the feature matrix of a dataset, row i belongs to row i of the dataset
+    :param dataset_path: parquet file of the dataset
+    :param matrix: float32 matrix with the scalar columns following wkid, osm_id and match and the concatenated encodings of every row
+    :return:
+    """
+    path = matrix_path(dataset_path)
+    np.save(path, matrix)
+    resources.publish(path, matrix)
+
+
+def load_features(dataset_path: str) -> np.ndarray:
+    """
+    feature matrix of an embedded dataset for training and prediction, memory mapped without copying
+    :param dataset_path: parquet file of the dataset
+    :return: float32 matrix with one row per pair
+    """
+    return resources.consume(matrix_path(dataset_path), lambda path: np.load(path, mmap_mode='r'))
@@ -11,6 +11,9 @@ from imblearn.over_sampling import SMOTE
 import pickle
 import time
 import configparser
+import resources
+import stageMetrics
+import embeddingStore
 
 DATA_DIR = sys.argv[1]
 CONFIG_PATH = sys.argv[2]
@@ -20,6 +23,7 @@ config.read(CONFIG_PATH)
 
 MODEL_TYPE = config.get('legacy', 'model')
 DO_OVERSAMPLING = config.getboolean('legacy', 'do_oversampling')
+USE_LEGACY_EMBEDDINGS = config.getboolean('legacy', 'use_legacy_embeddings')
 DATASET_PATH = DATA_DIR + 'el training set.parquet'
 DATASET_FORMAT = 'parquet'
 EXPERIMENT_NAME = 'FTB'
@@ -32,13 +36,21 @@ print('entity linking')
 if DATASET_FORMAT == 'tsv':
     data = pd.read_csv(DATASET_PATH, sep='\t', index_col=False)
 else:
-    data = pd.read_parquet(DATASET_PATH)
+    data = resources.consume(DATASET_PATH, pd.read_parquet)
+
+stageMetrics.count('rows_in', len(data))
+
+if USE_LEGACY_EMBEDDINGS:
+    features = data.iloc[:, 3:].to_numpy()
+else:
+    # scalar columns and fasttext encodings are stored as float32 matrix next to the dataset
+    features = embeddingStore.load_features(DATASET_PATH)
 
 # stratifiedgroupkfold, train test split
-train_idx, test_idx = next(GroupShuffleSplit(test_size=.3).split(X=data.iloc[:, 3:], y=data.iloc[:, 2], groups=data.iloc[:,0]))
-x_train = data.iloc[train_idx, 3:]
+train_idx, test_idx = next(GroupShuffleSplit(test_size=.3).split(X=features, y=data.iloc[:, 2], groups=data.iloc[:,0]))
+x_train = features[train_idx]
 y_train = data.iloc[train_idx, 2]
-x_test = data.iloc[test_idx, 3:]
+x_test = features[test_idx]
 y_test = data.iloc[test_idx, 2]
 
 # Oversampling for better train results
@@ -4,7 +4,9 @@ import keras
 from keras.layers import *
 from keras.models import Model
 from keras import backend as K
-import fasttext
+import resources
+import stageMetrics
+import candidateStore
 import numpy as np
 import tensorflow as tf
 import configparser
@@ -20,6 +22,8 @@ from attention import Attention
 from crossAttention import CrossAttention
 
 tf.get_logger().setLevel('ERROR')
+# release models of previous iterations when running in process
+tf.keras.backend.clear_session()
 
 
 
@@ -30,8 +34,7 @@ config = configparser.ConfigParser()
 config.read(CONFIG_PATH)
 
 
-DATASET_PATH = DATA_DIR + 'train pairs.tsv'
-PREDICTSET_PATH = DATA_DIR + 'unmatched pairs.tsv'
+DATASET_PATH = DATA_DIR + candidateStore.PAIR_FILES['train']
 FT_PATH = config.get('fasttext', 'location')
 # Model Metadata
 NUM_EPOCHS = config.getint('entity linking', 'epochs')
@@ -44,12 +47,13 @@ print('entity linking with attention')
 print('-loading fasttext model')
 print(f'-from: {FT_PATH}')
 
-ft_model = fasttext.load_model(FT_PATH)
+ft_model = resources.load_fasttext(FT_PATH)
 embedding_dim = 300
 
 print('-loading data')
 print(f'-from {DATASET_PATH}')
-data = pd.read_csv(DATASET_PATH, delimiter='\t')
+data = candidateStore.load_pairs(DATA_DIR, 'train')
+stageMetrics.count('rows_in', len(data))
 tags = data['tags'].astype(str)
 properties = data['properties'].astype(str)
 y = data['match'].values
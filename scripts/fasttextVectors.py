@@ -0,0 +1,233 @@
+import os
+import json
+import multiprocessing
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# markers fasttext puts around every word before splitting it into character ngrams
+BOW = b'<'
+EOW = b'>'
+EOS = b'</s>'
+
+# worker processes keep their memory mapped vectors here
+_vectors = None
+
+FNV_OFFSET = 2166136261
+FNV_PRIME = np.uint32(16777619)
+
+
+def fnv_hashes(buffer: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    32 bit FNV-1a hashes of byte ranges as computed by fasttext (bytes are sign extended before xor)
+    all ranges are hashed together, one vectorized step per byte position
+    :param buffer: uint8 array of utf-8 encoded strings
+    :param starts: start of every range in buffer
+    :param lengths: length of every range
+    :return: uint32 array with one hash per range
+    """
+    hashes = np.full(len(starts), FNV_OFFSET, dtype=np.uint32)
+    signed = buffer.view(np.int8).astype(np.int32).astype(np.uint32)
+    for k in range(int(np.max(lengths, initial=0))):
+        active = np.flatnonzero(lengths > k)
+        hashes[active] = (hashes[active] ^ signed[starts[active] + k]) * FNV_PRIME
+    return hashes
+
+
+def fnv_hash(data: bytes) -> int:
+    """
+    32 bit FNV-1a hash of a single string as computed by fasttext
+    :param data: utf-8 encoded string
+    :return: unsigned 32 bit hash
+    """
+    return int(fnv_hashes(np.frombuffer(data, dtype=np.uint8), np.zeros(1, dtype=np.int64), np.array([len(data)]))[0])
+
+
+def _concat(words: list) -> tuple:
+    # buffer, starts and lengths of byte strings for fnv_hashes
+    lengths = np.array([len(word) for word in words], dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    return np.frombuffer(b''.join(words), dtype=np.uint8), starts, lengths
+
+
+def is_exported(path: str, model_path: str) -> bool:
+    """
+    check if the vectors of a model have been exported to path
+    :param path: folder of the exported vectors
+    :param model_path: location of the fasttext .bin model
+    :return: True if the export belongs to the current model file
+    """
+    try:
+        with open(os.path.join(path, 'args.json'), 'r', encoding='utf-8') as file:
+            args = json.load(file)
+    except (OSError, ValueError):
+        return False
+    return args.get('source') == _source(model_path)
+
+
+def _source(model_path: str) -> list:
+    return [os.path.abspath(model_path), os.path.getsize(model_path), os.path.getmtime(model_path)]
+
+
+def export_model(model, model_path: str, path: str) -> None:
+    """
+    write the input matrix, vocabulary and subword arguments of a fasttext model as memory mappable files
+    the vocabulary is stored as open addressing hash table over the concatenated utf-8 words
+    :param model: loaded fasttext model
+    :param model_path: location of the fasttext .bin model
+    :param path: folder to write the vectors to
+    :return:
+    """
+    os.makedirs(path, exist_ok=True)
+    args = model.f.getArgs()
+    words = [word.encode('utf-8', 'surrogateescape') for word in model.get_words(on_unicode_error='surrogateescape')]
+    buffer, starts, lengths = _concat(words)
+    offsets = np.append(starts, len(buffer))
+    table = np.full(2 * len(words) + 1, -1, dtype=np.int32)
+    for i, h in enumerate((fnv_hashes(buffer, starts, lengths) % len(table)).tolist()):
+        while table[h] >= 0:
+            h = (h + 1) % len(table)
+        table[h] = i
+    np.save(os.path.join(path, 'input.npy'), np.asarray(model.get_input_matrix(), dtype=np.float32))
+    np.save(os.path.join(path, 'table.npy'), table)
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+    np.save(os.path.join(path, 'words.npy'), buffer)
+    # written last, an interrupted export is not mistaken for a complete one
+    with open(os.path.join(path, 'args.json'), 'w', encoding='utf-8') as file:
+        json.dump({'nwords': len(words), 'minn': args.minn, 'maxn': args.maxn, 'bucket': args.bucket,
+                   'dim': args.dim, 'source': _source(model_path)}, file)
+
+
+class MappedVectors:
+    """
+    Word vectors of an exported fasttext model read from memory mapped files
+    Vectors are computed like get_word_vector of fasttext: the mean of the input rows of the word
+    (if in the vocabulary) and of its hashed character ngrams. Processes mapping the same files
+    share a single copy of the model in the page cache.
+    """
+    def __init__(self, path: str):
+        """
+        :param path: folder written by export_model
+        """
+        with open(os.path.join(path, 'args.json'), 'r', encoding='utf-8') as file:
+            self.args = json.load(file)
+        self.dim = self.args['dim']
+        # plain arrays over the mapped files, indexing a np.memmap adds python overhead to every lookup
+        self.matrix, self.table, self.offsets, self.words = [np.asarray(np.load(os.path.join(path, name), mmap_mode='r'))
+                                                             for name in ['input.npy', 'table.npy', 'offsets.npy', 'words.npy']]
+
+    def word_id(self, word: bytes, h: int = None) -> int:
+        """
+        :param word: utf-8 encoded word
+        :param h: fnv hash of the word if already known
+        :return: position of the word in the vocabulary, -1 if unknown
+        """
+        slot = (fnv_hash(word) if h is None else h) % len(self.table)
+        while self.table[slot] >= 0:
+            i = self.table[slot]
+            if self.words[self.offsets[i]:self.offsets[i + 1]].tobytes() == word:
+                return int(i)
+            slot = (slot + 1) % len(self.table)
+        return -1
+
+    def subwords(self, words: list) -> tuple:
+        """
+        rows of the input matrix making up words, the words themselves and their character ngrams
+        :param words: utf-8 encoded words
+        :return: tuple of row indices and the position of the word each row belongs to, ordered by word
+        """
+        ids, owners = [], []
+        buffer, starts, lengths = _concat(words)
+        for t, (word, h) in enumerate(zip(words, fnv_hashes(buffer, starts, lengths).tolist())):
+            i = self.word_id(word, h)
+            if i >= 0:
+                ids.append(i)
+                owners.append(t)
+        ids, owners = [np.array(ids, dtype=np.int64)], [np.array(owners, dtype=np.int64)]
+
+        # ngrams start at the first byte of utf-8 characters and contain minn to maxn characters
+        minn, maxn, bucket, nwords = self.args['minn'], self.args['maxn'], self.args['bucket'], self.args['nwords']
+        buffer, starts, lengths = _concat([b'' if word == EOS else BOW + word + EOW for word in words])
+        chars = np.flatnonzero(buffer & 0xC0 != 0x80)
+        boundaries = np.append(chars, len(buffer))
+        char_owner = np.searchsorted(starts + lengths, chars, side='right')
+        per_word = np.bincount(char_owner, minlength=len(words))
+        # number of characters of the word and position of every character in its word
+        char_counts = per_word[char_owner]
+        position = np.arange(len(chars)) - (np.cumsum(per_word) - per_word)[char_owner]
+        for n in range(max(minn, 1), maxn + 1):
+            valid = position + n <= char_counts
+            if n == 1:
+                valid &= (position > 0) & (position + 1 < char_counts)
+            first = np.flatnonzero(valid)
+            hashes = fnv_hashes(buffer, boundaries[first], boundaries[first + n] - boundaries[first])
+            ids.append(nwords + hashes.astype(np.int64) % bucket)
+            owners.append(char_owner[first])
+
+        ids, owners = np.concatenate(ids), np.concatenate(owners)
+        order = np.argsort(owners, kind='stable')
+        return ids[order], owners[order]
+
+    def encode(self, texts: list) -> np.ndarray:
+        """
+        :param texts: strings to encode
+        :return: matrix with one encoding per string, zeros for strings without known subwords
+        """
+        ids, owners = self.subwords([text.encode('utf-8') for text in texts])
+        counts = np.bincount(owners, minlength=len(texts))
+        # mean of the rows per string as one sparse product, reading only the needed rows of the mapped matrix
+        weights = csr_matrix(((1 / counts[owners]).astype(np.float32), (owners, ids)), shape=(len(texts), len(self.matrix)))
+        return np.asarray(weights @ self.matrix, dtype=np.float32)
+
+    def word_vector(self, text: str) -> np.ndarray:
+        """
+        :param text: string to encode
+        :return: encoding of the string like get_word_vector of fasttext
+        """
+        return self.encode([text])[0]
+
+
+def _init_worker(path: str) -> None:
+    global _vectors
+    _vectors = MappedVectors(path)
+
+
+def _encode_chunk(chunk: tuple) -> tuple:
+    start, texts = chunk
+    return start, _vectors.encode(texts)
+
+
+class ParallelEncoder:
+    """
+    Pool of worker processes encoding strings with the vectors exported by export_model
+    Strings are split into chunks handed to the workers, their encodings are gathered into one
+    preallocated matrix. Workers are forked, stages running inside runExperiment.py are not started again.
+    """
+    def __init__(self, path: str, workers: int, chunk_size: int = 256):
+        """
+        :param path: folder written by export_model
+        :param workers: number of worker processes
+        :param chunk_size: number of strings per task
+        """
+        with open(os.path.join(path, 'args.json'), 'r', encoding='utf-8') as file:
+            self.dim = json.load(file)['dim']
+        self.chunk_size = chunk_size
+        self.pool = multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker, initargs=(path,))
+
+    def encode(self, texts: list) -> np.ndarray:
+        """
+        :param texts: strings to encode
+        :return: matrix with one encoding per string
+        """
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        chunks = ((i, texts[i:i + self.chunk_size]) for i in range(0, len(texts), self.chunk_size))
+        for start, vectors in self.pool.imap_unordered(_encode_chunk, chunks):
+            out[start:start + len(vectors)] = vectors
+        return out
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+
+def can_fork() -> bool:
+    return 'fork' in multiprocessing.get_all_start_methods()
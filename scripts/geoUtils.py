@@ -0,0 +1,104 @@
+import numpy as np
+
+EARTH_RADIUS = 6378137.0  # radius of the spherical earth used by web mercator (EPSG:3857)
+MAX_LATITUDE = 85.06
+
+
+def _coordinates(location) -> tuple:
+    try:
+        lon, lat = location[location.index('(') + 1:location.rindex(')')].split()
+        return float(lon), float(lat)
+    except (AttributeError, TypeError, ValueError):
+        return np.nan, np.nan
+
+
+def parse_points(locations) -> tuple:
+    """
+    coordinates of wkt points
+    :param locations: iterable of wkt points, e.g. Point(2.29 48.85)
+    :return: tuple of longitude and latitude arrays, nan for missing or invalid locations
+    """
+    coordinates = np.array([_coordinates(location) for location in locations], dtype=np.float64).reshape(-1, 2)
+    return coordinates[:, 0], coordinates[:, 1]
+
+
+def to_web_mercator(lon: np.ndarray, lat: np.ndarray) -> tuple:
+    """
+    project wgs84 coordinates to web mercator (EPSG:3857), the projection of the osm geometries
+    :param lon: longitudes in degrees
+    :param lat: latitudes in degrees
+    :return: tuple of x and y arrays in meters
+    """
+    x = EARTH_RADIUS * np.radians(lon)
+    y = EARTH_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)) / 2))
+    return x, y
+
+
+def _grid(values: np.ndarray, low: float, high: float, bits: int) -> np.ndarray:
+    # integer cell of every value on a grid of 2^bits cells between low and high
+    cells = 1 << bits
+    scaled = (values - low) / (high - low) if high > low else np.zeros(len(values))
+    return np.clip(np.floor(scaled * cells), 0, cells - 1).astype(np.int64)
+
+
+def hilbert_keys(lon: np.ndarray, lat: np.ndarray, bits: int = 16) -> np.ndarray:
+    """
+    position of points on a hilbert curve through their bounding box
+    :param lon: longitudes
+    :param lat: latitudes
+    :param bits: resolution of the curve per axis
+    :return: array of curve positions
+    """
+    if len(lon) == 0:
+        return np.zeros(0, dtype=np.int64)
+    n = 1 << bits
+    x = _grid(lon, np.min(lon), np.max(lon), bits)
+    y = _grid(lat, np.min(lat), np.max(lat), bits)
+    keys = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+        keys += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve continues in the next level
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+    return keys
+
+
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    # insert a zero bit after every bit of the lower 32 bits
+    v = v.astype(np.uint64)
+    for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def geohash_keys(lon: np.ndarray, lat: np.ndarray, bits: int = 25) -> np.ndarray:
+    """
+    geohash of points as integer, sorting by it orders points like sorting by geohash strings
+    :param lon: longitudes
+    :param lat: latitudes
+    :param bits: resolution per axis (25 bits correspond to a geohash of length 10)
+    :return: array of interleaved longitude and latitude bits
+    """
+    return (_spread_bits(_grid(lon, -180, 180, bits)) << np.uint64(1)) | _spread_bits(_grid(lat, -90, 90, bits))
+
+
+def curve_order(lon: np.ndarray, lat: np.ndarray, curve: str) -> np.ndarray:
+    """
+    order of points along a space filling curve, neighbouring points end up close to each other
+    :param lon: longitudes
+    :param lat: latitudes
+    :param curve: hilbert or geohash
+    :return: indices sorting the points, points without coordinates (nan) last
+    """
+    located = np.flatnonzero(~(np.isnan(lon) | np.isnan(lat)))
+    missing = np.flatnonzero(np.isnan(lon) | np.isnan(lat))
+    keys = hilbert_keys(lon[located], lat[located]) if curve == 'hilbert' else geohash_keys(lon[located], lat[located])
+    return np.concatenate([located[np.argsort(keys, kind='stable')], missing])
@@ -0,0 +1,94 @@
+import json
+import time
+import sqlite3
+import stageMetrics
+
+# sqlite limits the number of parameters per statement
+_CHUNK_SIZE = 500
+
+
+class KGCache:
+    """
+    On disk cache of knowledge graph lookups shared by all stages and iterations
+    Values are stored as json per query kind (e.g. 'wikidata popularity') and key (e.g. a QID).
+    Entries older than ttl_days count as missing. Once more than max_entries are stored, the
+    least recently used entries are removed. Without a path nothing is cached.
+    """
+    def __init__(self, path: str = None, ttl_days: float = 30, max_entries: int = 1000000):
+        """
+        :param path: sqlite file, None or empty to disable caching
+        :param ttl_days: age in days after which entries are fetched again
+        :param max_entries: maximum number of stored entries
+        """
+        self.ttl = ttl_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                                    kind TEXT NOT NULL,
+                                    key TEXT NOT NULL,
+                                    value TEXT,
+                                    fetched REAL NOT NULL,
+                                    used REAL NOT NULL,
+                                    PRIMARY KEY (kind, key))""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            self.conn.commit()
+
+    def get_many(self, kind: str, keys: list) -> dict:
+        """
+        look up cached values
+        :param kind: kind of query the values belong to
+        :param keys: keys to look up
+        :return: dictionary of the keys found in the cache and their values
+        """
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        if self.conn is not None:
+            now = time.time()
+            for i in range(0, len(keys), _CHUNK_SIZE):
+                chunk = keys[i:i + _CHUNK_SIZE]
+                rows = self.conn.execute(f"""SELECT key, value FROM entries
+                                             WHERE kind = ? AND fetched >= ? AND key IN ({','.join('?' * len(chunk))})""",
+                                         [kind, now - self.ttl] + chunk).fetchall()
+                found.update({key: json.loads(value) for key, value in rows})
+                self.conn.executemany("UPDATE entries SET used = ? WHERE kind = ? AND key = ?",
+                                      [(now, kind, key) for key, _ in rows])
+            self.conn.commit()
+        stageMetrics.count('kg_cache_hits', len(found))
+        stageMetrics.count('kg_cache_misses', len(keys) - len(found))
+        return found
+
+    def put_many(self, kind: str, values: dict) -> None:
+        """
+        store fetched values, replacing older entries
+        :param kind: kind of query the values belong to
+        :param values: dictionary of keys and json serializable values
+        :return:
+        """
+        if self.conn is None or not values:
+            return
+        now = time.time()
+        self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                              [(kind, key, json.dumps(value), now, now) for key, value in values.items()])
+        self.conn.commit()
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        remove expired entries and the least recently used ones above max_entries
+        :return:
+        """
+        if self.conn is None:
+            return
+        self.conn.execute("DELETE FROM entries WHERE fetched < ?", (time.time() - self.ttl,))
+        excess = self.conn.execute("SELECT count(*) FROM entries").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.conn.execute("""DELETE FROM entries WHERE rowid IN
+                                    (SELECT rowid FROM entries ORDER BY used ASC LIMIT ?)""", (excess,))
+        self.conn.commit()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,93 @@
+import re
+import numpy as np
+from scipy.sparse import csr_matrix
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def trigrams(name: str) -> set:
+    """
+    character trigrams of a name in the way pg_trgm builds them
+    every lowercase word is padded with two spaces in front and one at the end
+    :param name: name to split, anything but a string has no trigrams
+    :return: set of trigrams
+    """
+    grams = set()
+    if not isinstance(name, str):
+        return grams
+    for word in WORD_PATTERN.findall(name.lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Inverted character trigram index over names for blocking by name similarity
+    Similarity is computed like pg_trgm: shared trigrams divided by the number of distinct trigrams
+    of both names. Shared trigrams of query names are counted with sparse matrix products against the
+    index. Common trigrams (e.g. 'str') match a large share of all names, so query names are
+    multiplied in chunks whose number of trigram matches stays below max_pairs, and only the best
+    results of every name are kept before the next chunk.
+    """
+    def __init__(self, names, max_pairs: int = 10000000):
+        """
+        :param names: indexed names, empty names never match
+        :param max_pairs: maximum number of trigram matches (names x shared trigrams) computed at once
+        """
+        self.max_pairs = max_pairs
+        self.vocabulary = {}
+        rows, columns = [], []
+        for i, name in enumerate(names):
+            for gram in trigrams(name):
+                rows.append(i)
+                columns.append(self.vocabulary.setdefault(gram, len(self.vocabulary)))
+        self.size = len(names)
+        # names x trigrams, transposed once for the products with query blocks
+        matrix = csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(self.size, len(self.vocabulary)))
+        self.sizes = np.asarray(matrix.sum(axis=1)).ravel()
+        self.index = matrix.T.tocsr()
+        # number of names containing each trigram
+        self.frequencies = np.diff(self.index.indptr).astype(np.int64)
+
+    def query(self, names, limit: int = 100, min_similarity: float = 0.3, allowed=None) -> list:
+        """
+        most similar indexed names for a block of names
+        :param names: query names
+        :param limit: maximum number of results per name
+        :param min_similarity: minimum similarity of a result
+        :param allowed: optional function of (query position, array of indexed positions) returning a boolean mask of permitted results
+        :return: list with a tuple of indexed positions and similarities (sorted by descending similarity) per query name
+        """
+        rows, columns, query_sizes = [], [], []
+        for i, name in enumerate(names):
+            grams = trigrams(name)
+            query_sizes.append(len(grams))
+            for gram in grams:
+                if gram in self.vocabulary:
+                    rows.append(i)
+                    columns.append(self.vocabulary[gram])
+        queries = csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(len(names), len(self.vocabulary)))
+        # upper bound of the nonzeros every query name adds to the product
+        costs = np.cumsum(np.bincount(rows, weights=self.frequencies[columns], minlength=len(names)))
+
+        results = []
+        start = 0
+        while start < len(names):
+            # at least one name per chunk, even if it alone exceeds max_pairs
+            end = max(start + 1, int(np.searchsorted(costs, (costs[start - 1] if start else 0) + self.max_pairs, side='right')))
+            shared = (queries[start:end] @ self.index).tocsr()
+            for i in range(start, end):
+                row = i - start
+                positions = shared.indices[shared.indptr[row]:shared.indptr[row + 1]]
+                counts = shared.data[shared.indptr[row]:shared.indptr[row + 1]]
+                similarity = counts / (query_sizes[i] + self.sizes[positions] - counts)
+                keep = similarity >= min_similarity
+                if allowed is not None:
+                    keep &= allowed(i, positions)
+                positions, similarity = positions[keep], similarity[keep]
+                order = np.argsort(-similarity, kind='stable')[:limit]
+                results.append((positions[order], similarity[order]))
+            del shared
+            start = end
+        return results
@@ -1,11 +1,9 @@
 import os
-import csv
 import sys
 import configparser
-import asyncio
-import asyncpg
-from queue import Queue
-from threading import Thread
+import resources
+import stageMetrics
+from batchWriter import BatchWriter
 
 DATA_DIR = sys.argv[1]
 CONFIG_PATH = sys.argv[2]
@@ -13,58 +11,25 @@ CONFIG_PATH = sys.argv[2]
 config = configparser.ConfigParser()
 config.read(CONFIG_PATH)
 
-PW_FILENAME = config.get('postGIS', 'passwordfile')
-PG_HOST = config.get('postGIS', 'host')
-PG_USER = config.get('postGIS', 'user')
-PG_DB_NAME = config.get('postGIS', 'dbname')
-PG_PORT = config.getint('postGIS', 'port')
-OUTPUT_FILENAME = os.path.join(DATA_DIR, 'osm_rdf.tsv')
+OUTPUT_FILENAME = os.path.join(DATA_DIR, 'osm rbf.tsv')
 TESTRUN = config.getboolean('misc', 'testrun')
 LIMIT = config.getint('misc', 'limit', fallback=1000)
 BASE_TABLE = config.get('entity linking', 'base_table')
 PREDICTION_TABLE = config.get('entity linking', 'prediction_table')
+FETCH_SIZE = config.getint('postGIS', 'fetch_size', fallback=5000)
+QUEUE_SIZE = config.getint('misc', 'queue_size', fallback=10000)
+BATCH_SIZE = config.getint('misc', 'write_batch_size', fallback=1000)
 
 print('Translating OSM to RDF')
 
-# Read the password
-with open(PW_FILENAME, 'r', encoding='utf-8') as file:
-    password = file.read().strip()
-
-def consume(stop, queue, filename) -> None:
-    """
-    Consumer function for threaded file writing
-    :param stop: function to define stop condition
-    :param queue: queue to read content from
-    :param filename: filename to write to
-    :return:
-    """
-    with open(filename, 'w', encoding='utf-8', newline='') as file:
-        writer = csv.writer(file, delimiter='\t')
-        while True:
-            if not queue.empty():
-                i = queue.get()
-                writer.writerow(i)
-            elif stop():
-                print('- Stopping file writing thread')
-                return
-
-queue = Queue()
-stop_threads = False
-
 print('- Starting file writing thread')
 
-consumer = Thread(target=consume, daemon=True, args=(lambda: stop_threads, queue, OUTPUT_FILENAME))
-consumer.start()
+# bounded, so fetching from the database waits for the file writer instead of piling up rows
+writer = BatchWriter(OUTPUT_FILENAME, QUEUE_SIZE, BATCH_SIZE)
 
 async def fetch_osm_entities():
-    conn = await asyncpg.connect(
-        user=PG_USER, 
-        password=password, 
-        database=PG_DB_NAME, 
-        host=PG_HOST, 
-        port=PG_PORT
-    )
-    
+    pool = await resources.get_pool(config)
+
     sql = f"""
     SELECT g.osm_id, ST_X(ST_Transform(way, 4326)) lon, ST_Y(ST_Transform(way, 4326)) lat, jsonb_strip_nulls(to_jsonb(g)), pe.wkid 
         FROM {BASE_TABLE} g JOIN {PREDICTION_TABLE} pe ON g.osm_id = pe.osm_id
@@ -73,10 +38,12 @@ async def fetch_osm_entities():
     if TESTRUN:
         sql += f" LIMIT {LIMIT}"
 
-    async with conn.transaction():
-        rows = await conn.fetch(sql)
-        
-        for row in rows:
+    num_rows = 0
+    async with pool.acquire() as conn, conn.transaction():
+        stageMetrics.count('db_queries')
+        # server side cursor, rows are transferred in chunks of FETCH_SIZE
+        async for row in conn.cursor(sql, prefetch=FETCH_SIZE):
+            num_rows += 1
             triplets = []
             id = row['osm_id']
             lon = row['lon']
@@ -113,15 +80,15 @@ async def fetch_osm_entities():
                 k = k.replace(" ", "")
                 triplets.append([id_string, f"<https://wiki.openstreetmap.org/wiki/Key:{k}>", f'"{v}"'])
 
-            for triplet in triplets:
-                queue.put(triplet)
+            writer.put_many(triplets)
+            stageMetrics.count('rows_out', len(triplets))
 
-    await conn.close()
+    stageMetrics.count('rows_in', num_rows)
 
 print('- Collecting OSM entities')
-asyncio.run(fetch_osm_entities())
+resources.run(fetch_osm_entities())
 
-stop_threads = True
-consumer.join()
+writer.close()
+print('- Stopped file writing thread')
 
 print('- Translation complete')
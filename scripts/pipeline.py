@@ -0,0 +1,274 @@
+import os
+import sys
+import ast
+import json
+import runpy
+import hashlib
+import tempfile
+import subprocess
+import asyncpg
+import stageMetrics
+import resources
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class DatabaseState:
+    """
+    Fingerprints of the database objects read and written by stages
+    Used as stage inputs and outputs for the stage cache
+    """
+    def __init__(self, config):
+        self.config = config
+        self.prediction_table = config.get('entity linking', 'prediction_table')
+        self.view_name = config.get('entity linking', 'view_name')
+
+    def predictions(self, iteration: int):
+        """
+        fingerprint of all entity links predicted up to the given iteration (0 = ground truth)
+        :param iteration: last iteration to include
+        :return: function computing the fingerprint
+        """
+        sql = f"""SELECT count(*), coalesce(sum(hashtext(wkid || ':' || osm_id)), 0)
+                  FROM {self.prediction_table} WHERE iteration <= {int(iteration)}"""
+        return lambda: self._fingerprint(sql)
+
+    def view(self):
+        """
+        fingerprint of the content of the candidate view
+        :return: function computing the fingerprint
+        """
+        sql = f"""SELECT count(*), coalesce(sum(hashtext(osm_id || ':' || coalesce(wkid, ''))), 0)
+                  FROM {self.view_name}"""
+        return lambda: self._fingerprint(sql)
+
+    def rollback(self, iteration: int) -> None:
+        """
+        remove predictions of the given and all following iterations
+        :param iteration: first iteration to remove
+        :return:
+        """
+        async def delete():
+            pool = await resources.get_pool(self.config)
+            try:
+                async with pool.acquire() as conn:
+                    await conn.execute(f"DELETE FROM {self.prediction_table} WHERE iteration >= $1", iteration)
+            except asyncpg.UndefinedTableError:
+                pass
+        resources.run(delete())
+
+    def _fingerprint(self, sql: str):
+        async def fetch():
+            pool = await resources.get_pool(self.config)
+            try:
+                async with pool.acquire() as conn:
+                    return list(await conn.fetchrow(sql))
+            except asyncpg.PostgresError:
+                # object does not exist (yet)
+                return None
+        return resources.run(fetch())
+
+
+def local_modules(path: str) -> list:
+    """
+    sibling modules a script imports, directly or through other sibling modules
+    :param path: script file
+    :return: sorted paths of the imported modules next to the script or in the scripts folder
+    """
+    found = set()
+    pending = [os.path.abspath(path)]
+    while pending:
+        current = pending.pop()
+        with open(current, 'r', encoding='utf-8') as file:
+            tree = ast.parse(file.read(), current)
+        names = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names.update(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names.add(node.module.split('.')[0])
+        for name in names:
+            for folder in [os.path.dirname(current), SCRIPT_DIR]:
+                module = os.path.join(folder, name + '.py')
+                if os.path.isfile(module):
+                    if module not in found:
+                        found.add(module)
+                        pending.append(module)
+                    break
+    found.discard(os.path.abspath(path))
+    return sorted(found)
+
+
+class StageCache:
+    """
+    Content addressed record of finished stages
+    A stage is identified by its script and arguments. Its input hash covers the script source and the
+    sibling modules it imports, the config values it uses, the content of its input files and fingerprints of the database state it reads.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                content = json.load(file)
+        else:
+            content = {}
+        self.stages = content.get('stages', {})
+        self.files = content.get('files', {})  # digests of files by path, size and modification time
+
+    def file_digest(self, path: str):
+        """
+        content hash of a file or folder
+        :param path: path to hash
+        :return: hex digest or None if the path does not exist
+        """
+        if os.path.isdir(path):
+            sha = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    sha.update(os.path.relpath(file_path, path).encode('utf-8'))
+                    sha.update(self.file_digest(file_path).encode('utf-8'))
+            return sha.hexdigest()
+        if not os.path.isfile(path):
+            return None
+
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        known = self.files.get(key)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha.update(chunk)
+        self.files[key] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def digest(self, items: list) -> list:
+        """
+        hash stage inputs or outputs
+        :param items: file paths or functions returning a database fingerprint
+        :return: list of digests in the order of items
+        """
+        return [item() if callable(item) else self.file_digest(item) for item in items]
+
+    def lookup(self, key: str, input_hash: str, outputs: list) -> bool:
+        entry = self.stages.get(key)
+        if not entry or entry['inputs'] != input_hash:
+            return False
+        # outputs have to be present and unchanged since the stage finished
+        return entry['outputs'] == self.digest(outputs)
+
+    def store(self, key: str, input_hash: str, outputs: list) -> None:
+        self.stages[key] = {'inputs': input_hash, 'outputs': self.digest(outputs)}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'stages': self.stages, 'files': self.files}, file)
+        os.replace(tmp_path, self.path)
+
+
+class Pipeline:
+    """
+    Runs the experiment stages (scripts in this folder) one after another
+    In process mode every stage is executed inside the current interpreter, so imported libraries
+    and the resources kept in resources.py stay loaded for all following stages and iterations.
+    With a cache file, stages whose inputs did not change since a previous run are skipped and
+    their outputs reused. Time, memory and counters of every stage are appended to the metrics file.
+    """
+    def __init__(self, config, in_process: bool = True, cache_path: str = None, metrics_path: str = None):
+        self.config = config
+        self.in_process = in_process
+        resources.set_publishing(in_process)
+        self.cache = StageCache(cache_path) if cache_path else None
+        self.metrics_path = metrics_path
+        self.records = []
+        self.db = DatabaseState(config)
+        self.rolled_back = set()
+        if SCRIPT_DIR not in sys.path:
+            sys.path.insert(0, SCRIPT_DIR)
+
+    def run_stage(self, script: str, *args, iteration: int = 0, config: list = (), inputs: list = (), outputs: list = ()) -> None:
+        """
+        run a single stage script with the given command line arguments
+        :param script: path of the script relative to the scripts folder
+        :param args: command line arguments passed to the script
+        :param iteration: experiment iteration the stage belongs to
+        :param config: config sections or (section, option) tuples used by the stage
+        :param inputs: files and database fingerprints (see DatabaseState) read by the stage
+        :param outputs: files and database fingerprints written by the stage
+        :return:
+        """
+        path = os.path.join(SCRIPT_DIR, script)
+        argv = [path] + [str(a) for a in args]
+        child_file = None if self.in_process else os.path.join(tempfile.gettempdir(), f'stage metrics {os.getpid()}.json')
+        measurement = stageMetrics.Measurement(child_file)
+
+        if self.cache is not None:
+            key = ' '.join([script] + argv[1:])
+            input_hash = self._input_hash(path, argv, config, inputs)
+            if self.cache.lookup(key, input_hash, outputs):
+                print(f'-reusing cached results of {script}')
+                self._record(script, iteration, measurement, cached=True)
+                return
+            if iteration and iteration not in self.rolled_back:
+                # predictions of a previous run are recomputed from here on
+                self.db.rollback(iteration)
+                self.rolled_back.add(iteration)
+
+        self._execute(path, argv, child_file)
+
+        if self.cache is not None:
+            self.cache.store(key, input_hash, outputs)
+        self._record(script, iteration, measurement, cached=False)
+
+    def _record(self, script: str, iteration: int, measurement: stageMetrics.Measurement, cached: bool) -> None:
+        record = {'stage': os.path.splitext(os.path.basename(script))[0], 'iteration': iteration, 'cached': cached}
+        record.update(measurement.finish())
+        self.records.append(record)
+        if self.metrics_path:
+            stageMetrics.write_record(self.metrics_path, record)
+
+    def _input_hash(self, path: str, argv: list, config: list, inputs: list) -> str:
+        sha = hashlib.sha256()
+        sha.update(self.cache.file_digest(path).encode('utf-8'))
+        # changes to imported helper modules (candidateStore, geoUtils, ...) invalidate the stage too
+        for module in local_modules(path):
+            sha.update(os.path.basename(module).encode('utf-8'))
+            sha.update(self.cache.file_digest(module).encode('utf-8'))
+        values = []
+        for entry in config:
+            if isinstance(entry, tuple):
+                values.append([entry[0], entry[1], self.config.get(entry[0], entry[1], fallback=None)])
+            else:
+                values.append([entry, sorted(self.config.items(entry)) if self.config.has_section(entry) else None])
+        sha.update(json.dumps([argv[1:], values, self.cache.digest(inputs)], default=str).encode('utf-8'))
+        return sha.hexdigest()
+
+    def _execute(self, path: str, argv: list, child_file: str = None) -> None:
+        if not self.in_process:
+            env = dict(os.environ, **{stageMetrics.METRICS_ENV: child_file})
+            subprocess.run([sys.executable] + argv, check=True, env=env)
+            return
+
+        # scripts expect their own folder on the path for sibling imports
+        stage_dir = os.path.dirname(path)
+        prev_argv = sys.argv
+        sys.argv = argv
+        sys.path.insert(0, stage_dir)
+        try:
+            runpy.run_path(path, run_name='__main__')
+        finally:
+            sys.argv = prev_argv
+            sys.path.remove(stage_dir)
+
+    def end_iteration(self) -> None:
+        # outputs not picked up by a following stage are not needed anymore
+        resources.clear_artifacts()
+
+    def summary(self) -> str:
+        return stageMetrics.summary(self.records)
+
+    def close(self) -> None:
+        resources.close()
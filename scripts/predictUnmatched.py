@@ -4,8 +4,10 @@ import pickle
 import pandas as pd
 import sys
 import configparser
-import asyncio
-import asyncpg
+import resources
+import stageMetrics
+import candidateStore
+import embeddingStore
 import tensorflow as tf
 import keras
 import numpy as np
@@ -26,7 +28,7 @@ if not USE_ATTENTION:
     MODEL_TYPE = config.get('entity linking', 'model')
     CLASSIFIER_LOCATION = DATA_DIR + MODEL_TYPE + '.sav'  # location of classifier model saved to pickle file
 else:
-    DATASET_LOCATION = DATA_DIR + 'unmatched pairs.tsv'
+    DATASET_LOCATION = DATA_DIR + candidateStore.PAIR_FILES['unmatched']
     CLASSIFIER_LOCATION = DATA_DIR + 'self attention.sav'
     OSM_TOKENIZER_LOCATION = DATA_DIR + 'osm tokenizer.sav'
     WIKIDATA_TOKENIZER_LOCATION = DATA_DIR + 'wikidata tokenizer.sav'
@@ -35,11 +37,6 @@ OUTPUT_PATH = DATA_DIR + 'predicted entity matches.tsv'
 PREDICTION_THRESHOLD = config.getfloat('entity linking', 'prediction_threshold')
 
 # postGIS config
-PW_FILENAME = config.get('postGIS', 'passwordfile')
-PG_HOST = config.get('postGIS', 'host')
-PG_USER = config.get('postGIS', 'user')
-PG_DB_NAME = config.get('postGIS', 'dbname')
-PG_PORT = config.getint('postGIS', 'port')
 TABLE_NAME = config.get('entity linking', 'prediction_table')
 
 print('predicting entity matches')
@@ -64,7 +61,7 @@ def f1_m(y_true, y_pred):
     return 2*((precision*recall)/(precision+recall+K.epsilon()))
 
 if USE_ATTENTION:
-    data = pd.read_csv(DATASET_LOCATION, delimiter='\t')
+    data = candidateStore.load_pairs(DATA_DIR, 'unmatched')
 
     print('-loading classifier')
     print(f'-from: {CLASSIFIER_LOCATION}')
@@ -95,7 +92,7 @@ if USE_ATTENTION:
     probabilities = model.predict([x_osm, x_wiki, x_dist])
     prediction = (probabilities >= PREDICTION_THRESHOLD)
 else:
-    data = pd.read_parquet(DATASET_LOCATION, engine='pyarrow')
+    data = resources.consume(DATASET_LOCATION, lambda path: pd.read_parquet(path, engine='pyarrow'))
 
     print('-loading classifier')
     print(f'-from: {CLASSIFIER_LOCATION}')
@@ -103,13 +100,15 @@ else:
         model = pickle.load(file)
 
     print(f'-predicting matches with threshold: {PREDICTION_THRESHOLD}')
-    predicted_values = model.predict_proba(data.iloc[:, 3:])
+    predicted_values = model.predict_proba(embeddingStore.load_features(DATASET_LOCATION))
     probabilities = predicted_values[:, 1]
     prediction = (probabilities >= PREDICTION_THRESHOLD)
 
 print(f'-Number of predicted matches: {int(prediction.sum())} / {len(prediction)}')
 print(f'-matched percentage: {(int(prediction.sum()) / len(prediction)) * 100: .2f}%')
 
+stageMetrics.count('rows_in', len(data))
+
 prediction_pairs = pd.DataFrame()
 prediction_pairs['wkid'] = data['wkid']
 prediction_pairs['osm_id'] = data['osm_id']
@@ -125,9 +124,6 @@ print('-writing complete')
 prediction_pairs = prediction_pairs[prediction]
 
 # update predictions in database
-with open(PW_FILENAME, 'r') as file:
-    password = file.read().strip()
-
 async def generate_list(df: pd.DataFrame) -> tuple:
     entries = []
     for index, row in df.iterrows():
@@ -135,27 +131,23 @@ async def generate_list(df: pd.DataFrame) -> tuple:
     return tuple(entries)
 
 async def update_predictions():
-    conn = await asyncpg.connect(
-        user=PG_USER,
-        password=password,
-        database=PG_DB_NAME,
-        host=PG_HOST,
-        port=PG_PORT
-    )
+    pool = await resources.get_pool(config)
 
     sql = f"INSERT INTO {TABLE_NAME} (wkid, osm_id, confidence, iteration) VALUES "
     i = 0
     batchsize = 2
 
-    async with conn.transaction():
+    async with pool.acquire() as conn, conn.transaction():
+        # replace predictions of a previous run of this iteration
+        await conn.execute(f"DELETE FROM {TABLE_NAME} WHERE iteration >= $1", ITERATION)
         while i < len(prediction_pairs) - 1:
             offset = min(batchsize, len(prediction_pairs) - 1 - i)
             inserts = ','.join(["($1, $2, $3, $4)"] * offset)
             await conn.execute(sql + inserts, *generate_list(prediction_pairs[i:i + offset]))
+            stageMetrics.count('db_queries')
             i += offset
 
-    await conn.close()
-
+stageMetrics.count('rows_out', len(prediction_pairs))
 print(f'-writing matches to {TABLE_NAME}')
-asyncio.run(update_predictions())
+resources.run(update_predictions())
 print(f'-writing complete')
@@ -1,18 +1,13 @@
 import sys
 import configparser
-import asyncio
-import asyncpg
+import resources
+import stageMetrics
 
 CONFIG_PATH = sys.argv[1]
 
 config = configparser.ConfigParser()
 config.read(CONFIG_PATH)
 
-PW_FILENAME = config.get('postGIS', 'passwordfile')
-PG_HOST = config.get('postGIS', 'host')
-PG_USER = config.get('postGIS', 'user')
-PG_DB_NAME = config.get('postGIS', 'dbname')
-PG_PORT = config.getint('postGIS', 'port')
 TABLE_NAME = config.get('entity linking', 'prediction_table')
 BASE_TABLE = config.get('entity linking', 'base_table')
 VIEW_NAME = config.get('entity linking', 'view_name')
@@ -21,9 +16,6 @@ DATA_SOURCE = config.get('meta', 'kg_source')
 
 print('preparing schema')
 
-with open(PW_FILENAME, 'r') as file:
-    password = file.read().strip()
-
 delete_index_sql = f"DROP INDEX IF EXISTS {INDEX_NAME}"
 delete_view = f"DROP MATERIALIZED VIEW IF EXISTS {VIEW_NAME}"
 delete_table = f"DROP TABLE IF EXISTS {TABLE_NAME}"
@@ -55,16 +47,9 @@ else:
     """
 
 async def execute_sql():
-    conn = await asyncpg.connect(
-        user=PG_USER,
-        password=password,
-        database=PG_DB_NAME,
-        host=PG_HOST,
-        port=PG_PORT
-    )
+    pool = await resources.get_pool(config)
 
-    async with conn.transaction():
-        cur = conn.cursor()
+    async with pool.acquire() as conn, conn.transaction():
         print('-deleting old view')
         await conn.execute(delete_index_sql)
         await conn.execute(delete_view)
@@ -74,7 +59,9 @@ async def execute_sql():
         await conn.execute(sql)
         print(f'-filling {TABLE_NAME} with ground truth')
         await conn.execute(init_sql)
+        stageMetrics.count('db_queries', 5)
 
-    await conn.close()
+    # statements cached by pooled connections refer to the dropped relations
+    await pool.expire_connections()
 
-asyncio.run(execute_sql())
+resources.run(execute_sql())
@@ -1,8 +1,8 @@
 import pandas as pd
 import sys
 import configparser
-import asyncio
-import asyncpg
+import resources
+import stageMetrics
 
 DATA_DIR = sys.argv[1]
 CONFIG_PATH = sys.argv[2]
@@ -14,18 +14,15 @@ CLASS_FILE = DATA_DIR + 'predicted classes.tsv'
 QID_INDEX_FILE = DATA_DIR + 'qid_index.tsv'
 CLASS_OUTPUT_PATH = DATA_DIR + 'wikidata classes.txt'
 COLUMN_FILE = config.get('nca', 'columns_location').strip()
-PW_FILENAME = config.get('postGIS', 'passwordfile')
-PG_HOST = config.get('postGIS', 'host')
-PG_USER = config.get('postGIS', 'user')
-PG_DB_NAME = config.get('postGIS', 'dbname')
-PG_PORT = config.getint('postGIS', 'port')
 VIEW_NAME = config.get('entity linking', 'view_name')
 INDEX_NAME = config.get('entity linking', 'index_name')
 BASE_TABLE = config.get('entity linking', 'base_table')
 PREDICTION_TABLE = config.get('entity linking', 'prediction_table')
+GENERATION_METHOD = config.get('candidate generation', 'method')
+USE_LEGACY_EMBEDDINGS = config.getboolean('legacy', 'use_legacy_embeddings')
 VIEW_SQL_PATH = DATA_DIR + 'create view.sql'
 
-classes = pd.read_csv(CLASS_FILE, delimiter='\t')
+classes = resources.consume(CLASS_FILE, lambda path: pd.read_csv(path, delimiter='\t'))
 qid_index = pd.read_csv(QID_INDEX_FILE, delimiter='\t', header=None)
 
 print('preparing class filtered entities')
@@ -44,7 +41,7 @@ async def gather_classes():
         print(f'-found {len(qids)} unique wiki classes matched')
         file.write('\n'.join(qids))
 
-asyncio.run(gather_classes())
+resources.run(gather_classes())
 
 print('-selecting osm classes for entity linking')
 
@@ -93,12 +90,24 @@ elif is_column:
 else:
     terms.append(f"tags -> '{prev}' in ({', '.join(same_group)})")
 
+# tags of every osm entity as used in candidate pairs, without geometry, ids and wiki links
+# computed once with the view instead of for every candidate pair
+tag_text_sql = """replace(concat_ws(' ',
+        (SELECT string_agg(c.key || ' ' || c.value, ' ') FROM jsonb_each_text(to_jsonb(gp) - 'way' - 'osm_id' - 'tags') c
+         WHERE c.value IS NOT NULL),
+        (SELECT string_agg(t.key || ' ' || t.value, ' ') FROM jsonb_each_text(to_jsonb(gp.tags)) t
+         WHERE t.value IS NOT NULL AND t.key NOT IN ('wikidata', 'wikipedia') AND t.key NOT LIKE 'osm\\_%')), E'\\n', ' ') tag_text"""
+tag_json_sql = """(jsonb_strip_nulls(to_jsonb(gp)) - 'way' - 'osm_id' - 'tags') || COALESCE(
+        (SELECT jsonb_object_agg(t.key, t.value) FROM jsonb_each(jsonb_strip_nulls(to_jsonb(gp.tags))) t
+         WHERE t.key NOT IN ('wikidata', 'wikipedia') AND t.key NOT LIKE 'osm\\_%'), '{}'::jsonb) tag_json"""
+tag_columns = [tag_text_sql, tag_json_sql] if USE_LEGACY_EMBEDDINGS else [tag_text_sql]
+
 delete_index_sql = f"DROP INDEX IF EXISTS {INDEX_NAME}"
 delete_sql = f"DROP MATERIALIZED VIEW IF EXISTS {VIEW_NAME}"
 
 sql = f"""
     CREATE MATERIALIZED VIEW {VIEW_NAME} as
-    SELECT gp.*, pe.wkid 
+    SELECT gp.*, pe.wkid, {', '.join(tag_columns)}
     FROM {BASE_TABLE} gp LEFT JOIN {PREDICTION_TABLE} pe ON gp.osm_id = pe.osm_id
     WHERE 
 """ + '\n or '.join(terms) + " WITH DATA"
@@ -108,35 +117,41 @@ CREATE INDEX {INDEX_NAME}
     ON {VIEW_NAME} 
     USING GIST (way)"""
 
+# trigram index on the normalized name for the name candidate method
+trigram_sql = "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+name_index_sql = f"""
+CREATE INDEX {INDEX_NAME}_name
+    ON {VIEW_NAME}
+    USING GIST (lower(name) gist_trgm_ops)
+    WHERE name IS NOT NULL"""
+
 verification_sql = f"SELECT COUNT(*) FROM {VIEW_NAME}"
 
 async def execute_sql():
-    with open(PW_FILENAME, 'r', encoding='utf-8') as file:
-        password = file.read().strip()
-
-    conn = await asyncpg.connect(
-        user=PG_USER,
-        password=password,
-        database=PG_DB_NAME,
-        host=PG_HOST,
-        port=PG_PORT
-    )
+    pool = await resources.get_pool(config)
 
     print(f'-creating view {VIEW_NAME}')
     with open(VIEW_SQL_PATH, 'w', encoding='utf-8', newline='') as file:
         file.write(sql)
 
-    async with conn.transaction():
+    async with pool.acquire() as conn, conn.transaction():
         await conn.execute(delete_index_sql)
         await conn.execute(delete_sql)
         await conn.execute(sql)
         await conn.execute(index_sql)
+        if GENERATION_METHOD == 'name':
+            await conn.execute(trigram_sql)
+            await conn.execute(name_index_sql)
+            stageMetrics.count('db_queries', 2)
         count = await conn.fetchval(verification_sql)
+        stageMetrics.count('db_queries', 5)
+        stageMetrics.count('rows_out', count)
 
-    print(f'-view contains {count} entries')
+    # statements cached by pooled connections refer to the replaced view
+    await pool.expire_connections()
 
-    await conn.close()
+    print(f'-view contains {count} entries')
 
-asyncio.run(execute_sql())
+resources.run(execute_sql())
 
 print('-view created')
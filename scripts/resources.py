@@ -0,0 +1,187 @@
+import os
+import json
+import asyncio
+import asyncpg
+
+# heavy resources shared by all stages running in the same interpreter
+# (see pipeline.py). When a stage is started as standalone script every
+# resource is simply created once for that process.
+_loop = None
+_pools = {}
+_ft_models = {}
+_kg_caches = {}
+_embedding_caches = {}
+_sparql_client = None
+_artifacts = {}
+# outputs are only kept for following stages running in the same interpreter
+_publishing = False
+
+
+def run(coroutine):
+    """
+    run coroutine on the shared event loop
+    replaces asyncio.run so pooled database connections survive between stages
+    :param coroutine: coroutine to execute
+    :return: result of the coroutine
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(coroutine)
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # decode json columns into python objects instead of strings
+    for json_type in ['json', 'jsonb']:
+        await conn.set_type_codec(json_type, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+async def get_pool(config) -> asyncpg.Pool:
+    """
+    get connection pool for the database defined in the postGIS config section
+    pools are created once and reused by every following stage
+    :param config: parsed experiment config
+    :return: asyncpg connection pool
+    """
+    key = (config.get('postGIS', 'host'), config.getint('postGIS', 'port'),
+           config.get('postGIS', 'user'), config.get('postGIS', 'dbname'))
+    if key not in _pools:
+        with open(config.get('postGIS', 'passwordfile'), 'r', encoding='utf-8') as file:
+            password = file.read().strip()
+        _pools[key] = await asyncpg.create_pool(
+            host=key[0],
+            port=key[1],
+            user=key[2],
+            database=key[3],
+            password=password,
+            min_size=1,
+            max_size=config.getint('postGIS', 'pool_size', fallback=4),
+            init=_init_connection
+        )
+    return _pools[key]
+
+
+def load_fasttext(path: str):
+    """
+    load fasttext model once per process
+    :param path: location of the fasttext .bin model
+    :return: fasttext model
+    """
+    if path not in _ft_models:
+        import warnings
+        import fasttext
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # supress warning about change of model class
+            _ft_models[path] = fasttext.load_model(path)
+    return _ft_models[path]
+
+
+def get_kg_cache(config):
+    """
+    get the on disk cache for knowledge graph lookups defined in the kg cache config section
+    :param config: parsed experiment config
+    :return: KGCache, caching nothing if no location is configured
+    """
+    path = config.get('kg cache', 'location', fallback='').strip()
+    if path not in _kg_caches:
+        from kgCache import KGCache
+        _kg_caches[path] = KGCache(path,
+                                   config.getfloat('kg cache', 'ttl_days', fallback=30),
+                                   config.getint('kg cache', 'max_entries', fallback=1000000))
+    return _kg_caches[path]
+
+
+def get_embedding_cache(config):
+    """
+    get the on disk cache for fasttext embeddings defined in the fasttext config section
+    :param config: parsed experiment config
+    :return: EmbeddingCache, caching nothing if no cache location is configured
+    """
+    path = config.get('fasttext', 'cache_location', fallback='').strip()
+    if path not in _embedding_caches:
+        from embeddingCache import EmbeddingCache
+        _embedding_caches[path] = EmbeddingCache(path)
+    return _embedding_caches[path]
+
+
+def get_sparql_client(config):
+    """
+    get the sparql client shared by all stages, configured by the sparql config section
+    :param config: parsed experiment config
+    :return: SparqlClient
+    """
+    global _sparql_client
+    if _sparql_client is None:
+        from sparqlClient import SparqlClient
+        _sparql_client = SparqlClient(config.getfloat('sparql', 'requests_per_second', fallback=5),
+                                      config.getint('sparql', 'max_in_flight', fallback=4),
+                                      config.getfloat('sparql', 'timeout', fallback=60),
+                                      config.getint('sparql', 'max_retries', fallback=3))
+    return _sparql_client
+
+
+def set_publishing(enabled: bool) -> None:
+    """
+    enable keeping stage outputs in memory, set by the pipeline when stages run in process
+    :param enabled: True if following stages run in this interpreter
+    :return:
+    """
+    global _publishing
+    _publishing = enabled
+
+
+def publish(path: str, obj) -> None:
+    """
+    keep the in memory version of a stage output written to path
+    the next stage reading path gets the object instead of parsing the file again
+    nothing is kept in standalone scripts and stages running as subprocess, no stage follows in the interpreter
+    :param path: file the object has been written to
+    :param obj: in memory object (e.g. dataframe or arrow table)
+    :return:
+    """
+    if _publishing:
+        _artifacts[os.path.abspath(path)] = (os.path.getmtime(path), obj)
+
+
+def consume(path: str, loader):
+    """
+    get stage output published for path or load it from disk
+    published objects are handed out once, as readers are free to modify them
+    :param path: file to read
+    :param loader: function reading the file if no object is available
+    :return: loaded object
+    """
+    entry = _artifacts.pop(os.path.abspath(path), None)
+    if entry is not None and os.path.exists(path) and os.path.getmtime(path) == entry[0]:
+        return entry[1]
+    return loader(path)
+
+
+def clear_artifacts() -> None:
+    _artifacts.clear()
+
+
+def close() -> None:
+    """
+    release all shared resources
+    :return:
+    """
+    global _loop, _sparql_client
+    if _loop is not None and not _loop.is_closed():
+        for pool in _pools.values():
+            _loop.run_until_complete(pool.close())
+        _loop.close()
+    _pools.clear()
+    for cache in _kg_caches.values():
+        cache.close()
+    _kg_caches.clear()
+    for cache in _embedding_caches.values():
+        cache.close()
+    _embedding_caches.clear()
+    if _sparql_client is not None:
+        _sparql_client.close()
+    _ft_models.clear()
+    _artifacts.clear()
+    _loop = None
+    _sparql_client = None
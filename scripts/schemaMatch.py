@@ -13,6 +13,9 @@ import random as rn
 import os
 import sys
 import configparser
+import resources
+import alignmentData
+import stageMetrics
 
 DATA_DIR = sys.argv[1]
 CONFIG_PATH = sys.argv[2]
@@ -20,7 +23,7 @@ CONFIG_PATH = sys.argv[2]
 config = configparser.ConfigParser()
 config.read(CONFIG_PATH)
 
-INPUT_FILE = DATA_DIR + 'nca dataset.tsv'
+INPUT_FILE = DATA_DIR + 'nca dataset.npz'
 OUTPUT_FILE = DATA_DIR + 'predicted classes.tsv'
 
 PREDICTION_THRESHOLD = config.getfloat('nca', 'prediction_threshold')
@@ -32,28 +35,32 @@ TESTRUN = config.getboolean('misc', 'testrun')
 if TESTRUN:
     PREDICTION_THRESHOLD = 0.1
 
-data = pd.read_csv(INPUT_FILE, sep='\t', encoding='utf-8',)
+_, data, data_columns = resources.consume(INPUT_FILE, alignmentData.load_dataset)
+stageMetrics.count('rows_in', data.shape[0])
 
 
-num = data._get_numeric_data()
-num[num > 1] = 1
+data = (data > 0).astype(np.int8)  # binary occurrence instead of counts
+occurrences = data.getnnz(axis=0)
 labelName = []
 colNameOsm = []
 colNameWiki = []
-for col in data.columns:
-    if 'cls_' in col:
+labelIndex = []
+osmIndex = []
+wikiIndex = []
+for i, col in enumerate(data_columns):
+    if col.startswith('cls_'):
         labelName.append(col)
-    if 'osmTagKey_' in col:
-        try:
-            if data[col].value_counts()[1]>50:
-                colNameOsm.append(col)
-        except KeyError:
-            KeyError
-    elif 'prop_' in col and 'prop_instance of' not in col:
+        labelIndex.append(i)
+    elif col.startswith('osmTagKey_'):
+        if occurrences[i] > 50:
+            colNameOsm.append(col)
+            osmIndex.append(i)
+    elif col.startswith('prop_') and col != 'prop_instance of':
         colNameWiki.append(col)
-labels =  data[labelName]
-columnsOSM = data[colNameOsm]
-columnsWiki = data[colNameWiki]
+        wikiIndex.append(i)
+labels = data[:, labelIndex]
+columnsOSM = data[:, osmIndex]
+columnsWiki = data[:, wikiIndex]
 labelNameDict = {}
 for i in range(len(labelName)):
     labelNameDict[i] = labelName[i]
@@ -72,12 +79,12 @@ for i in range(len(columns)):
 fold_var = 1
 kf = KFold(n_splits = 3, random_state = 42, shuffle = True)
 train_index, val_index = list(kf.split(columnsOSM,labels))[0]
-osm_train = columnsOSM.iloc[train_index].values
-osm_test = columnsOSM.iloc[val_index].values
-wiki_train = columnsWiki.iloc[train_index].values
-wiki_test = columnsWiki.iloc[val_index].values
-y_train = labels.iloc[train_index].values
-y_test = labels.iloc[val_index].values
+osm_train = columnsOSM[train_index].toarray()
+osm_test = columnsOSM[val_index].toarray()
+wiki_train = columnsWiki[train_index].toarray()
+wiki_test = columnsWiki[val_index].toarray()
+y_train = labels[train_index].toarray()
+y_test = labels[val_index].toarray()
 
 
 # generate training data for discriminator
@@ -281,4 +288,6 @@ matchDF = pd.DataFrame(matches, columns=['tag', 'cls', 'value'])
 matchDF = matchDF[matchDF['value'] > PREDICTION_THRESHOLD]
 print(f'-found {len(matchDF)} predicted class matches')
 matchDF.to_csv(OUTPUT_FILE, sep='\t', encoding='utf-8', index=False)
+resources.publish(OUTPUT_FILE, matchDF)
+stageMetrics.count('rows_out', len(matchDF))
 
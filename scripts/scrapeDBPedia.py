@@ -1,14 +1,12 @@
 import re
-from SPARQLWrapper import SPARQLWrapper
-from SPARQLWrapper import SPARQLExceptions
-from urllib.error import HTTPError
 from tqdm import tqdm
 import pyarrow as pa
 import pyarrow.parquet as pq
 import sys
 import configparser
-import time
-import socket
+import resources
+import dbpediaBackend
+import stageMetrics
 
 DATA_DIR = sys.argv[1]
 CONFIG_PATH = sys.argv[2]
@@ -24,14 +22,7 @@ LIMIT = config.getint('misc', 'limit')
 DBPEDIA_SOURCE = config.get('dbpedia scrape', 'dbpedia_source')
 DBPEDIA_COUNTRY = config.get('dbpedia scrape', 'country')
 
-if DBPEDIA_SOURCE == 'en':
-    sparql = SPARQLWrapper(f"http://dbpedia.org/sparql",
-                       returnFormat='json',
-                       agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5)')
-else:
-    sparql = SPARQLWrapper(f"http://{DBPEDIA_SOURCE}.dbpedia.org/sparql",
-                       returnFormat='json',
-                       agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5)')
+backend = dbpediaBackend.get_backend(config)
 
 print('-reading classes')
 print(f'-from: {CLASSFILE_PATH}')
@@ -43,45 +34,16 @@ with open(CLASSFILE_PATH, 'r', encoding='utf-8') as file:
             linked_classes.append(text)
 
 # collect geo entities for classes and initial data
-query = """
-PREFIX de: <http://de.dbpedia.org/resource/>
-PREFIX fr: <http://fr.dbpedia.org/resource/>
-PREFIX country: <http://dbpedia.org/resource/>
-PREFIX db: <http://dbpedia.org/resource/>
-PREFIX dbp: <http://dbpedia.org/property/>
-PREFIX dbo: <http://dbpedia.org/ontology/>
-
-SELECT ?item AVG(?lat) as ?lat AVG(?lon) as ?lon WHERE {
-    ?item rdf:type dbo:%s.
-    ?item dbo:country country:%s.
-    ?item geo:lat ?lat.
-    ?item geo:long ?lon
-} group by ?item
-"""
-
 entities = {}
 
 with tqdm(total=len(linked_classes), desc=f'-Gathering entities in ({DBPEDIA_COUNTRY})', miniters=1) as pbar:
-    for clazz in linked_classes:
-        try:
-            pbar.set_postfix_str(f'class: {clazz}')
-            sparql.setQuery(query % (clazz, DBPEDIA_COUNTRY))
-            results = sparql.query().convert()
-            for res in results['results']['bindings']:
-                id = res['item']['value'].split('/')[-1]
-                entities.update({id: {'wkid': id, 'location': f"Point({res['lon']['value']} {res['lat']['value']})", 'type': clazz}})
-        except SPARQLExceptions.QueryBadFormed as e:
-            print(repr(e))
-        except HTTPError as e:
-            time.sleep(5)
-            pbar.write(f'{clazz}: {repr(e)}')
-            continue
-        except KeyboardInterrupt as e:
-            print(repr(e))
-            break
-        except socket.timeout:
-            pbar.write(f'timeout: {clazz}')
-            time.sleep(5)
+    for clazz, members in backend.class_members(DBPEDIA_SOURCE, DBPEDIA_COUNTRY, linked_classes):
+        pbar.set_postfix_str(f'class: {clazz}')
+        if members is None:
+            pbar.write(f'{clazz}: query failed, skipping...')
+        else:
+            for id, location in members:
+                entities.update({id: {'wkid': id, 'location': location, 'type': clazz}})
         pbar.update(1)
         if TESTRUN:
             if len(entities) > LIMIT:
@@ -118,56 +80,12 @@ def filter_key_value_pairs(pairs: list) -> str:
             filtered_items.extend([key, value])
     return ' '.join(filtered_items)
 
-property_query = """
-PREFIX de: <http://de.dbpedia.org/resource/>
-PREFIX fr: <http://fr.dbpedia.org/resource/>
-PREFIX db: <http://dbpedia.org/resource/>
-PREFIX dbp: <http://dbpedia.org/property/>
-PREFIX dbo: <http://dbpedia.org/ontology/>
-
-select distinct ?item ?property ?value
-    where {
-        VALUES ?item {%s}
-        ?item ?property ?value.
-    }
-"""
+properties = backend.properties(DBPEDIA_SOURCE, list(entities.keys()))
+# keep the last part of property and value uris
+properties = {e: [(k.split('/')[-1], v.split('/')[-1]) for k, v in pairs] for e, pairs in properties.items()}
 
 for k, v in entities.items():
-    v.update({'properties': ''})
-
-i = 0
-step_size = 70
-with tqdm(total=len(entities), desc='-updating properties') as pbar:
-    while i < len(entities):
-        id_string = ' '.join(f"<http://dbpedia.org/resource/{e}>" for e in list(entities.keys())[i:min(i+step_size, len(entities)-1)])
-        try:
-            sparql.setQuery(property_query % (id_string))
-            results = sparql.query().convert()
-            properties = {}
-            for res in results['results']['bindings']:
-                id = res['item']['value'].split('/')[-1]
-                if id not in properties:
-                    properties.update({id: []})
-
-                key = res['property']['value'].split('/')[-1]
-                value = res['value']['value'].split('/')[-1]
-                properties[id].append((key, value))
-            for k, v in properties.items():
-                entities[k].update({'properties': filter_key_value_pairs(v)})
-        except SPARQLExceptions.QueryBadFormed as e:
-            print(repr(e))
-        except HTTPError as e:
-            time.sleep(5)
-            pbar.write(f'{i}: {repr(e)}')
-            continue
-        except KeyboardInterrupt as e:
-            print(repr(e))
-            break
-        except socket.timeout:
-            pbar.write(f'timeout: {i}')
-            time.sleep(5)
-        i += step_size
-        pbar.update(step_size)
+    v.update({'properties': filter_key_value_pairs(properties.get(k, []))})
 
 def write_to_file(entity_dict: dict, filename: str) -> None:
     """
@@ -180,6 +98,9 @@ def write_to_file(entity_dict: dict, filename: str) -> None:
     table = pa.Table.from_pylist(data_list)
     with open(filename, 'wb') as file:
         pq.write_table(table, file)
+    # converted by the consuming stage, no dataframe is built if nothing consumes the table
+    resources.publish(filename, table)
+    stageMetrics.count('rows_out', len(data_list))
 
 print('-writing scraped data')
 print(f'-to: {OUTPUT_PATH}')
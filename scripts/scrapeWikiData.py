@@ -1,9 +1,11 @@
-from SPARQLWrapper import SPARQLWrapper
 from tqdm import tqdm
 import pyarrow as pa
 import pyarrow.parquet as pq
 import sys
 import configparser
+import resources
+import wikidataBackend
+import stageMetrics
 
 DATA_DIR = sys.argv[1]
 CONFIG_PATH = sys.argv[2]
@@ -20,9 +22,7 @@ COUNTRY_ID = config.get('wikidata scrape', 'country_id')
 SCRAPE_MODES = [s.strip() for s in config.get('wikidata scrape', 'scrape_values').split(',')]
 NAME_LANGUAGE = config.get('wikidata scrape', 'name_language')
 
-sparql = SPARQLWrapper("https://query.wikidata.org/sparql",
-                       returnFormat='json',
-                       agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5)')
+backend = wikidataBackend.get_backend(config)
 
 print('reading classes')
 print(f'from: {CLASSFILE_PATH}')
@@ -34,31 +34,16 @@ with open(CLASSFILE_PATH, 'r', encoding='utf-8') as file:
             linked_classes.append(text)
 
 # collect geo entities for classes and initial data
-query = """
-PREFIX wd: <http://www.wikidata.org/entity/>
-PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-
-SELECT ?item ?type ?location WHERE {
-    ?item wdt:P17 wd:%s. # in Germany
-    ?item wdt:P31* wd:%s. # instance or subinstance of (to be specified)
-    ?item wdt:P625 ?location.
-    FILTER (strstarts(str(?location), 'Point'))
-}
-"""
-
 entities = {}
 
 with tqdm(total=len(linked_classes), desc=f'-Gathering entities in ({COUNTRY_ID})', miniters=1) as pbar:
-    for clazz in linked_classes:
-        try:
-            pbar.set_postfix_str(f'class: {clazz}')
-            sparql.setQuery(query % (COUNTRY_ID, clazz))
-            results = sparql.query().convert()
-            for res in results['results']['bindings']:
-                wkid = res['item']['value'].split('/')[-1]
-                entities.update({wkid: {'wkid': wkid, 'location': res['location']['value'], 'type': clazz}})
-        except:
+    for clazz, members in backend.class_members(COUNTRY_ID, linked_classes):
+        pbar.set_postfix_str(f'class: {clazz}')
+        if members is None:
             pbar.write(f'An error occurred gathering {clazz}, skipping...')
+        else:
+            for wkid, location in members:
+                entities.update({wkid: {'wkid': wkid, 'location': location, 'type': clazz}})
         pbar.update(1)
         if TESTRUN:
             if len(entities) > LIMIT:
@@ -69,145 +54,32 @@ if TESTRUN:
 
 # update popularity
 if 'popularity' in SCRAPE_MODES:
-    pop_query = """
-    PREFIX wd: <http://www.wikidata.org/entity/>
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    
-    SELECT ?kgentity  (count(distinct ?p) as ?prop) ?location {
-      VALUES ?kgentity {%s}
-      ?kgentity ?p ?statement .
-      SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
-    } group by ?kgentity ?location
-    """
-
-    # set defaults
+    popularity = backend.popularity(list(entities.keys()))
     for k, v in entities.items():
-        v.update({'pop': 0})
-
-    i = 0
-    step_size = 300
-    with tqdm(total=len(entities), desc='-updating popularity') as pbar:
-        while i < len(entities):
-            id_string = ''.join(f"wd:{e} " for e in list(entities.keys())[i:min(i+step_size, len(entities)-1)])
-            sparql.setQuery(pop_query % id_string)
-            results = sparql.query().convert()
-            for res in results['results']['bindings']:
-                entities[res['kgentity']['value'].split('/')[-1]].update({'pop': int(res['prop']['value'])})
-            i += step_size
-            pbar.update(step_size)
-
-
+        v.update({'pop': popularity.get(k, 0)})
 
 # add type labels for entities
 if 'type labels' in SCRAPE_MODES:
-    label_query = """
-    PREFIX wd: <http://www.wikidata.org/entity/>
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    
-    SELECT ?kgentity (GROUP_CONCAT(distinct ?typeLabel; SEPARATOR = "; ") as ?labels) ?location {
-      VALUES ?kgentity {%s}
-      ?kgentity wdt:P31 ?label.
-      ?label rdfs:label ?typeLabel.
-      FILTER(lang(?typeLabel) = 'en').
-    } group by ?kgentity ?location
-    """
-
-    # set defaults
+    type_labels = backend.type_labels(list(entities.keys()))
     for k, v in entities.items():
-        v.update({'labels': ''})
-
-    i = 0
-    step_size = 300
-
-    with tqdm(total=len(entities), desc='-updating labels', miniters=1) as pbar:
-        while i < len(entities):
-            id_string = ''.join(f"wd:{e} " for e in list(entities.keys())[i:min(i+step_size, len(entities)-1)])
-            sparql.setQuery(label_query % id_string)
-            results = sparql.query().convert()
-            for res in results['results']['bindings']:
-                entities[res['kgentity']['value'].split('/')[-1]].update({'labels': res['labels']['value']})
-            i += step_size
-            pbar.update(step_size)
+        v.update({'labels': type_labels.get(k, '')})
 
 # add names to entities
 if 'name' in SCRAPE_MODES:
-    name_query = """
-    PREFIX wd: <http://www.wikidata.org/entity/>
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    
-    SELECT ?kgentity ?kgentityLabel {
-        VALUES ?kgentity {%s}
-        SERVICE wikibase:label { bd:serviceParam wikibase:language '%s', 'en'}
-    }
-    """
-
     # set defaults
     for k, v in entities.items():
         v.update({'name': ''})
 
-    i = 0
-    step_size = 300
-
-    with tqdm(total=len(entities), desc='-updating names', miniters=1) as pbar:
-        while i < len(entities):
-            id_string = ''.join(f"wd:{e} " for e in list(entities.keys())[i:min(i+step_size, len(entities)-1)])
-            sparql.setQuery(name_query % (id_string, NAME_LANGUAGE))
-            results = sparql.query().convert()
-            for res in results['results']['bindings']:
-                entities[res['kgentity']['value'].split('/')[-1]].update({'labels': res['kgentityLabel']['value']})
-            i += step_size
-            pbar.update(step_size)
-
+    names = backend.names(list(entities.keys()), NAME_LANGUAGE)
+    for k, v in entities.items():
+        if names.get(k) is not None:
+            v.update({'name': names[k]})
 
 # add full properties per entity
 if 'full properties' in SCRAPE_MODES:
-    property_query = """
-    PREFIX wd: <http://www.wikidata.org/entity/>
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    
-    SELECT ?kgentity ?kgentityLabel ?wdLabel ?ps_Label {
-        VALUES ?kgentity {%s}
-        ?kgentity ?p ?statement .
-        ?statement ?ps ?ps_ .
-  
-        ?wd wikibase:claim ?p.
-        ?wd wikibase:statementProperty ?ps.
-  
-        SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
-    } ORDER BY ?kgentity
-    """
-
-    # set defaults
+    properties = backend.properties(list(entities.keys()))
     for k, v in entities.items():
-        v.update({'properties': ''})
-
-    i = 0
-    step_size = 250
-
-    with tqdm(total=len(entities), desc='-updating properties', miniters=1) as pbar:
-        while i < len(entities):
-            try:
-                id_string = ''.join(f"wd:{e} " for e in list(entities.keys())[i:min(i+step_size, len(entities)-1)])
-                sparql.setQuery(property_query % id_string)
-                results = sparql.query().convert()
-                cur_id = ''
-                property_pairs = set()
-                for res in results['results']['bindings']:
-                    wkid = res['kgentity']['value'].split('/')[-1]
-                    if cur_id: # skip first test
-                        if cur_id != wkid:
-                            entities[cur_id].update({'properties': ' '.join(property_pairs)})
-                            property_pairs = set()
-                            property_pairs.add(f"{'label'} {res['kgentityLabel']['value']}")
-                    else:
-                        property_pairs.add(f"{'label'} {res['kgentityLabel']['value']}")
-                    property_pairs.add(f"{res['wdLabel']['value']} {res['ps_Label']['value']}")
-                    cur_id = wkid
-                entities[cur_id].update({'properties': ' '.join(property_pairs)})
-            except:
-                pbar.write(f'An error occurred gathering {i} - {i + step_size}, skipping...')
-            i += step_size
-            pbar.update(step_size)
+        v.update({'properties': properties.get(k, '')})
 
 def write_to_file(entity_dict: dict, filename: str) -> None:
     """
@@ -220,6 +92,9 @@ def write_to_file(entity_dict: dict, filename: str) -> None:
     table = pa.Table.from_pylist(data_list)
     with open(filename, 'wb') as file:
         pq.write_table(table, file)
+    # converted by the consuming stage, no dataframe is built if nothing consumes the table
+    resources.publish(filename, table)
+    stageMetrics.count('rows_out', len(data_list))
 
 print('-writing scraped data')
 print(f'-to: {OUTPUT_PATH}')
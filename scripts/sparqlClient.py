@@ -0,0 +1,172 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+import stageMetrics
+
+USER_AGENT = 'IGEA/1.0 (https://github.com/alishiba14/IGEA) python-requests/%s' % requests.__version__
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+class _Endpoint:
+    """
+    rate and concurrency limit of a single endpoint
+    every endpoint has its own worker threads, so queries to one endpoint do not take the slots of another
+    """
+    def __init__(self, requests_per_second: float, max_in_flight: int):
+        self.interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='sparql')
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self) -> None:
+        # reserve the next free slot, so requests are spread evenly over time
+        with self.lock:
+            slot = max(time.monotonic(), self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - time.monotonic()))
+
+    def back_off(self, seconds: float) -> None:
+        # no request to this endpoint before the server allows it again
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+def _retry_after(response: requests.Response, default: float) -> float:
+    value = response.headers.get('Retry-After')
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return default
+
+
+class SparqlClient:
+    """
+    Sparql client sending queries concurrently over a pooled http session
+    Every endpoint gets its own limit of requests per second and of requests in flight. Responses
+    with status 429 or 503 pause the endpoint for the time given in their Retry-After header.
+    query_many returns results in the order of the queries.
+    """
+    def __init__(self, requests_per_second: float = 5, max_in_flight: int = 4, timeout: float = 60, max_retries: int = 3):
+        """
+        :param requests_per_second: maximum number of requests started per second and endpoint
+        :param max_in_flight: maximum number of concurrent requests per endpoint
+        :param timeout: timeout of a single request in seconds
+        :param max_retries: number of retries of failed requests
+        """
+        self.requests_per_second = requests_per_second
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT, 'Accept': 'application/sparql-results+json'})
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def query(self, endpoint: str, query: str, timeout: float = None):
+        """
+        send a single query
+        :param endpoint: url of the sparql endpoint
+        :param query: sparql query
+        :param timeout: request timeout overriding the default
+        :return: parsed json result or None if the query failed
+        """
+        result = self._query(endpoint, query, timeout)
+        stageMetrics.count('sparql_queries')
+        return result
+
+    def query_many(self, endpoint: str, queries, timeout: float = None):
+        """
+        send queries concurrently
+        :param endpoint: url of the sparql endpoint
+        :param queries: iterable of sparql queries
+        :param timeout: request timeout overriding the default
+        :return: generator of parsed json results (None for failed queries) in the order of queries
+        """
+        executor = self._endpoint(endpoint).executor
+        pending = deque()
+        for query in queries:
+            pending.append(executor.submit(self._query, endpoint, query, timeout))
+            # keep a limited number of queries ahead of the consumer
+            if len(pending) >= 2 * self.max_in_flight:
+                stageMetrics.count('sparql_queries')
+                yield pending.popleft().result()
+        while pending:
+            stageMetrics.count('sparql_queries')
+            yield pending.popleft().result()
+
+    def close(self) -> None:
+        for limit in self.endpoints.values():
+            limit.executor.shutdown(wait=True)
+        self.session.close()
+
+    def _endpoint(self, endpoint: str) -> _Endpoint:
+        with self.lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = _Endpoint(self.requests_per_second, self.max_in_flight)
+            return self.endpoints[endpoint]
+
+    def _query(self, endpoint: str, query: str, timeout: float = None):
+        limit = self._endpoint(endpoint)
+        error = None
+        for attempt in range(self.max_retries + 1):
+            with limit.in_flight:
+                limit.wait()
+                try:
+                    response = self.session.post(endpoint, data={'query': query}, timeout=timeout or self.timeout)
+                except requests.RequestException as e:
+                    error = e
+                    limit.back_off(2 ** attempt)
+                    continue
+            if response.status_code in RETRY_STATUS:
+                error = f'{response.status_code} {response.reason}'
+                limit.back_off(_retry_after(response, 2 ** attempt))
+                continue
+            if not response.ok:
+                # malformed query or similar, retrying does not help
+                print(f'sparql query to {endpoint} failed: {response.status_code} {response.reason}')
+                return None
+            try:
+                return response.json()
+            except ValueError as e:
+                error = e
+        print(f'sparql query to {endpoint} failed after {self.max_retries + 1} attempts: {error!r}')
+        return None
+
+
+def wikidata_endpoint(config) -> str:
+    return config.get('sparql', 'wikidata_endpoint', fallback='https://query.wikidata.org/sparql')
+
+
+def dbpedia_endpoint(config, language: str) -> str:
+    """
+    endpoint of the dbpedia chapter of the given language
+    :param config: parsed experiment config
+    :param language: language code, e.g. fr for fr.dbpedia.org
+    :return: url of the sparql endpoint
+    """
+    if language == 'en':
+        return config.get('sparql', 'dbpedia_en_endpoint', fallback='http://dbpedia.org/sparql')
+    return config.get('sparql', 'dbpedia_endpoint', fallback='http://{language}.dbpedia.org/sparql').format(language=language)
+
+
+def batches(ids: list, size: int) -> list:
+    """
+    split ids into batches for VALUES clauses
+    :param ids: entity ids
+    :param size: maximum number of ids per batch
+    :return: list of batches
+    """
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import atexit
+from collections import Counter
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on windows
+
+# counters reported by stages, e.g. rows_in, rows_out, db_queries, sparql_queries
+counters = Counter()
+
+# set by pipeline.py for stages started as separate process
+METRICS_ENV = 'IGEA_METRICS_FILE'
+
+
+def count(name: str, amount: int = 1) -> None:
+    """
+    add to a counter of the running stage
+    :param name: counter name
+    :param amount: value to add
+    :return:
+    """
+    counters[name] += int(amount)
+
+
+def reset_peak_rss() -> bool:
+    """
+    reset the peak resident set size of this process (linux only)
+    :return: True if the peak could be reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss() -> int:
+    """
+    peak resident set size of this process in bytes
+    :return: peak rss or 0 if unknown
+    """
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return 0
+
+
+def _children_usage() -> tuple:
+    if resource is None:
+        return 0.0, 0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * 1024
+
+
+class Measurement:
+    """
+    Wall time, cpu time, peak memory and counters of a single stage
+    """
+    def __init__(self, child_file: str = None):
+        """
+        :param child_file: file the stage writes its values to when running as separate process
+        """
+        self.child_file = child_file
+        counters.clear()
+        reset_peak_rss()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.children_cpu = _children_usage()[0]
+
+    def finish(self) -> dict:
+        """
+        :return: measured values
+        """
+        record = {
+            'wall_time': time.perf_counter() - self.wall,
+            'cpu_time': time.process_time() - self.cpu,
+            'peak_rss': peak_rss(),
+            'counters': dict(counters),
+        }
+        if self.child_file:
+            children_cpu, children_rss = _children_usage()
+            record.update({'cpu_time': children_cpu - self.children_cpu, 'peak_rss': children_rss, 'counters': {}})
+            if os.path.exists(self.child_file):
+                with open(self.child_file, 'r', encoding='utf-8') as file:
+                    child = json.load(file)
+                record.update({'peak_rss': child['peak_rss'], 'counters': child['counters']})
+                os.remove(self.child_file)
+        counters.clear()
+        return record
+
+
+def _write_child_metrics() -> None:
+    with open(os.environ[METRICS_ENV], 'w', encoding='utf-8') as file:
+        json.dump({'peak_rss': peak_rss(), 'counters': dict(counters)}, file)
+
+
+if os.environ.get(METRICS_ENV):
+    atexit.register(_write_child_metrics)
+
+
+def write_record(path: str, record: dict) -> None:
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+def summary(records: list) -> str:
+    """
+    format stage records as table
+    :param records: records as written to metrics.jsonl
+    :return: table string
+    """
+    header = ['it', 'stage', 'wall', 'cpu', 'peak MB', 'rows in', 'rows out', 'db', 'sparql']
+    rows = []
+    for r in records:
+        c = r['counters']
+        rows.append([str(r['iteration']), r['stage'] + (' (cached)' if r['cached'] else ''),
+                     time.strftime('%H:%M:%S', time.gmtime(r['wall_time'])),
+                     time.strftime('%H:%M:%S', time.gmtime(r['cpu_time'])),
+                     f"{r['peak_rss'] / 2 ** 20:.0f}",
+                     str(c.get('rows_in', '')), str(c.get('rows_out', '')),
+                     str(c.get('db_queries', '')), str(c.get('sparql_queries', ''))])
+    widths = [max(len(row[i]) for row in rows + [header]) for i in range(len(header))]
+    lines = [' | '.join(h.ljust(w) for h, w in zip(header, widths)),
+             '-+-'.join('-' * w for w in widths)]
+    lines.extend(' | '.join(v.ljust(w) for v, w in zip(row, widths)) for row in rows)
+    return '\n'.join(lines)
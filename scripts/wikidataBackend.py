@@ -0,0 +1,423 @@
+import os
+import bz2
+import gzip
+import json
+import sqlite3
+from tqdm import tqdm
+import resources
+import sparqlClient
+
+ENTITY_PREFIX = 'http://www.wikidata.org/entity/'
+CHUNK_SIZE = 500  # sqlite limits the number of parameters per statement
+INSERT_BATCH = 10000
+
+CLASS_QUERY = """
+PREFIX wd: <http://www.wikidata.org/entity/>
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+
+SELECT ?item ?type ?location WHERE {
+    ?item wdt:P17 wd:%s. # in Germany
+    ?item wdt:P31* wd:%s. # instance or subinstance of (to be specified)
+    ?item wdt:P625 ?location.
+    FILTER (strstarts(str(?location), 'Point'))
+}
+"""
+
+POPULARITY_QUERY = """
+PREFIX wd: <http://www.wikidata.org/entity/>
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+
+SELECT ?kgentity  (count(distinct ?p) as ?prop) ?location {
+  VALUES ?kgentity {%s}
+  ?kgentity ?p ?statement .
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
+} group by ?kgentity ?location
+"""
+
+TYPE_LABEL_QUERY = """
+PREFIX wd: <http://www.wikidata.org/entity/>
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+
+SELECT ?kgentity (GROUP_CONCAT(distinct ?typeLabel; SEPARATOR = "; ") as ?labels) ?location {
+  VALUES ?kgentity {%s}
+  ?kgentity wdt:P31 ?label.
+  ?label rdfs:label ?typeLabel.
+  FILTER(lang(?typeLabel) = 'en').
+} group by ?kgentity ?location
+"""
+
+NAME_QUERY = """
+PREFIX wd: <http://www.wikidata.org/entity/>
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+
+SELECT ?kgentity ?kgentityLabel {
+    VALUES ?kgentity {%s}
+    SERVICE wikibase:label { bd:serviceParam wikibase:language '%s', 'en'}
+}
+"""
+
+PROPERTY_QUERY = """
+PREFIX wd: <http://www.wikidata.org/entity/>
+PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+
+SELECT ?kgentity ?kgentityLabel ?wdLabel ?ps_Label {
+    VALUES ?kgentity {%s}
+    ?kgentity ?p ?statement .
+    ?statement ?ps ?ps_ .
+
+    ?wd wikibase:claim ?p.
+    ?wd wikibase:statementProperty ?ps.
+
+    SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
+} ORDER BY ?kgentity
+"""
+
+STATEMENT_QUERY = """SELECT ?kgentity  ?wdLabel ?ps_ ?ps_Label {
+  VALUES ?kgentity {%s}
+  ?kgentity ?p ?statement .
+  ?statement ?ps ?ps_ .
+
+  ?wd wikibase:claim ?p.
+  ?wd wikibase:statementProperty ?ps.
+
+  OPTIONAL {
+  ?statement ?pq ?pq_ .
+  ?wdpq wikibase:qualifier ?pq .
+  }
+
+  SERVICE wikibase:label { bd:serviceParam wikibase:language "en" }
+} ORDER BY ?wd ?statement ?ps_"""
+
+
+def _entity_id(uri: str) -> str:
+    return uri.split('/')[-1]
+
+
+def _id_string(batch: list) -> str:
+    return ''.join(f"wd:{e} " for e in batch)
+
+
+class SparqlBackend:
+    """
+    Answers the wikidata questions of the experiment with queries to the sparql endpoint
+    Results are cached in the kg cache (see kgCache.py), only missing entities are queried.
+    """
+    def __init__(self, config):
+        self.client = resources.get_sparql_client(config)
+        self.cache = resources.get_kg_cache(config)
+        self.endpoint = sparqlClient.wikidata_endpoint(config)
+
+    def class_members(self, country_id: str, classes: list):
+        """
+        entities with coordinates located in the country per class
+        :param country_id: QID of the country
+        :param classes: QIDs of the classes
+        :return: generator of (class, list of [QID, location] or None if the query failed) in the order of classes
+        """
+        members = self.cache.get_many('wikidata class members', [f'{country_id} {c}' for c in classes])
+        missing = [c for c in classes if f'{country_id} {c}' not in members]
+        results = self.client.query_many(self.endpoint, [CLASS_QUERY % (country_id, c) for c in missing])
+        for clazz in classes:
+            key = f'{country_id} {clazz}'
+            if key not in members:
+                result = next(results)  # results arrive in the order of missing
+                if result is None:
+                    yield clazz, None
+                    continue
+                members[key] = [[_entity_id(res['item']['value']), res['location']['value']] for res in result['results']['bindings']]
+                self.cache.put_many('wikidata class members', {key: members[key]})
+            yield clazz, members[key]
+
+    def popularity(self, ids: list) -> dict:
+        def parse(batch, bindings):
+            fetched = dict.fromkeys(batch, 0)
+            for res in bindings:
+                fetched[_entity_id(res['kgentity']['value'])] = int(res['prop']['value'])
+            return fetched
+        return self._fetch('wikidata popularity', ids, 300, lambda b: POPULARITY_QUERY % _id_string(b), parse, '-updating popularity')
+
+    def type_labels(self, ids: list) -> dict:
+        def parse(batch, bindings):
+            fetched = dict.fromkeys(batch, '')
+            for res in bindings:
+                fetched[_entity_id(res['kgentity']['value'])] = res['labels']['value']
+            return fetched
+        return self._fetch('wikidata type labels', ids, 300, lambda b: TYPE_LABEL_QUERY % _id_string(b), parse, '-updating labels')
+
+    def names(self, ids: list, language: str) -> dict:
+        def parse(batch, bindings):
+            fetched = dict.fromkeys(batch, None)
+            for res in bindings:
+                fetched[_entity_id(res['kgentity']['value'])] = res['kgentityLabel']['value']
+            return fetched
+        return self._fetch(f'wikidata names {language}', ids, 300, lambda b: NAME_QUERY % (_id_string(b), language), parse, '-updating names')
+
+    def properties(self, ids: list) -> dict:
+        def parse(batch, bindings):
+            fetched = dict.fromkeys(batch, '')
+            cur_id = ''
+            property_pairs = set()
+            for res in bindings:
+                wkid = _entity_id(res['kgentity']['value'])
+                if cur_id != wkid:
+                    if cur_id:
+                        fetched[cur_id] = ' '.join(property_pairs)
+                    property_pairs = {f"label {res['kgentityLabel']['value']}"}
+                property_pairs.add(f"{res['wdLabel']['value']} {res['ps_Label']['value']}")
+                cur_id = wkid
+            if cur_id:
+                fetched[cur_id] = ' '.join(property_pairs)
+            return fetched
+        return self._fetch('wikidata properties', ids, 250, lambda b: PROPERTY_QUERY % _id_string(b), parse, '-updating properties')
+
+    def statements(self, ids: list) -> dict:
+        def parse(batch, bindings):
+            fetched = {w: [] for w in batch}
+            for res in bindings:
+                fetched[_entity_id(res['kgentity']['value'])].append(res)
+            return fetched
+        return self._fetch('wikidata statements', ids, 300, lambda b: STATEMENT_QUERY % _id_string(b), parse, '-collecting wikidata information')
+
+    def _fetch(self, kind: str, ids: list, batch_size: int, make_query, parse, desc: str) -> dict:
+        values = self.cache.get_many(kind, ids)
+        missing = [e for e in dict.fromkeys(ids) if e not in values]
+        batches = sparqlClient.batches(missing, batch_size)
+        with tqdm(total=len(missing), desc=desc, miniters=1) as pbar:
+            for batch, result in zip(batches, self.client.query_many(self.endpoint, [make_query(b) for b in batches])):
+                try:
+                    fetched = parse(batch, result['results']['bindings'])
+                    self.cache.put_many(kind, fetched)
+                    values.update(fetched)
+                except (TypeError, KeyError, ValueError):
+                    # failed queries (None) and unexpected results, entities are queried again in the next run
+                    pbar.write(f'An error occurred gathering {batch[0]} - {batch[-1]}, skipping...')
+                pbar.update(len(batch))
+        return values
+
+
+def _datavalue_id(value: dict) -> str:
+    """
+    :param value: value of a wikibase-entityid datavalue, older dumps carry only the numeric-id
+    :return: QID/PID of the entity
+    """
+    return value.get('id') or f"Q{value['numeric-id']}"
+
+
+def _format_value(datavalue: dict):
+    """
+    value of a statement from the json dump in the form returned by sparql
+    :param datavalue: datavalue of a snak
+    :return: (uri or literal, QID/PID if the value is an entity else None)
+    """
+    value = datavalue['value']
+    value_type = datavalue['type']
+    if value_type == 'wikibase-entityid':
+        entity = _datavalue_id(value)
+        return ENTITY_PREFIX + entity, entity
+    if value_type == 'monolingualtext':
+        return value['text'], None
+    if value_type == 'quantity':
+        return value['amount'].lstrip('+'), None
+    if value_type == 'time':
+        return value['time'].lstrip('+'), None
+    if value_type == 'globecoordinate':
+        return f"Point({value['longitude']} {value['latitude']})", None
+    return str(value), None
+
+
+def _open_dump(path: str):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+class DumpBackend:
+    """
+    Answers the wikidata questions of the experiment from a local store built from a json dump
+    The dump (https://dumps.wikimedia.org/wikidatawiki/entities/, one entity per line, optionally
+    bz2 or gz compressed) is streamed once. Entities located in the country (P17) are kept with all
+    their statements, labels are kept for all entities to resolve statement values and classes. The
+    store is rebuilt when dump, country or languages change.
+    Differences to the sparql backend: class members are direct instances (P31) of a class with
+    coordinates (P625), popularity is the number of distinct properties with statements, statements
+    of entities outside the country are not available.
+    """
+    def __init__(self, dump_path: str, store_path: str, country_id: str, languages: list):
+        """
+        :param dump_path: wikidata json dump
+        :param store_path: sqlite file of the local store
+        :param country_id: QID of the country entities have to be located in
+        :param languages: label languages to keep, english labels are always kept
+        """
+        self.country_id = country_id
+        self.languages = sorted(set(languages) | {'en'})
+        stat = os.stat(dump_path)
+        self.source = json.dumps([os.path.abspath(dump_path), stat.st_size, stat.st_mtime_ns, country_id, self.languages])
+        if not self._is_current(store_path):
+            self._build(dump_path, store_path)
+        self.conn = sqlite3.connect(store_path)
+
+    def class_members(self, country_id: str, classes: list):
+        if country_id != self.country_id:
+            raise ValueError(f'store was built for country {self.country_id}, not {country_id}')
+        for clazz in classes:
+            rows = self.conn.execute("""SELECT e.id, e.location FROM instances i JOIN entities e ON e.id = i.id
+                                        WHERE i.class = ? AND e.location IS NOT NULL
+                                        UNION SELECT id, location FROM entities WHERE id = ? AND location IS NOT NULL""",
+                                     (clazz, clazz)).fetchall()
+            yield clazz, [list(r) for r in rows]
+
+    def popularity(self, ids: list) -> dict:
+        return self._select(ids, "SELECT id, popularity FROM entities WHERE id IN ({})")
+
+    def type_labels(self, ids: list) -> dict:
+        labels = {e: [] for e in ids}
+        query = """SELECT DISTINCT i.id, l.label FROM instances i
+                   JOIN labels l ON l.id = i.class AND l.lang = 'en'
+                   WHERE i.id IN ({})"""
+        for chunk in self._chunks(ids):
+            for wkid, label in self.conn.execute(query.format(','.join('?' * len(chunk))), chunk):
+                labels[wkid].append(label)
+        return {k: '; '.join(v) for k, v in labels.items()}
+
+    def names(self, ids: list, language: str) -> dict:
+        return self._select(ids, """SELECT e.id, coalesce(l.label, en.label, e.id) FROM entities e
+                                    LEFT JOIN labels l ON l.id = e.id AND l.lang = ?
+                                    LEFT JOIN labels en ON en.id = e.id AND en.lang = 'en'
+                                    WHERE e.id IN ({})""", [language])
+
+    def properties(self, ids: list) -> dict:
+        properties = dict.fromkeys(ids, '')
+        labels = self._select(ids, "SELECT id, label FROM labels WHERE lang = 'en' AND id IN ({})")
+        for wkid, bindings in self.statements(ids).items():
+            if bindings:
+                pairs = {f"label {labels.get(wkid, wkid)}"}
+                pairs.update(f"{b['wdLabel']['value']} {b['ps_Label']['value']}" for b in bindings)
+                properties[wkid] = ' '.join(pairs)
+        return properties
+
+    def statements(self, ids: list) -> dict:
+        """
+        statements of the entities in the layout of sparql result bindings
+        :param ids: QIDs
+        :return: dictionary of QID and list of bindings with kgentity, wdLabel, ps_ and ps_Label
+        """
+        statements = {e: [] for e in ids}
+        query = """SELECT c.id, coalesce(pl.label, c.prop), c.value, coalesce(vl.label, c.value_id, c.value)
+                   FROM claims c
+                   LEFT JOIN labels pl ON pl.id = c.prop AND pl.lang = 'en'
+                   LEFT JOIN labels vl ON vl.id = c.value_id AND vl.lang = 'en'
+                   WHERE c.id IN ({})"""
+        for chunk in self._chunks(ids):
+            for wkid, prop, value, value_label in self.conn.execute(query.format(','.join('?' * len(chunk))), chunk):
+                statements[wkid].append({'kgentity': {'value': ENTITY_PREFIX + wkid}, 'wdLabel': {'value': prop},
+                                         'ps_': {'value': value}, 'ps_Label': {'value': value_label}})
+        return statements
+
+    def _select(self, ids: list, query: str, params: list = ()) -> dict:
+        values = {}
+        for chunk in self._chunks(ids):
+            values.update(self.conn.execute(query.format(','.join('?' * len(chunk))), list(params) + chunk).fetchall())
+        return values
+
+    @staticmethod
+    def _chunks(ids: list) -> list:
+        ids = list(dict.fromkeys(ids))
+        return [ids[i:i + CHUNK_SIZE] for i in range(0, len(ids), CHUNK_SIZE)]
+
+    def _is_current(self, store_path: str) -> bool:
+        if not os.path.isfile(store_path):
+            return False
+        with sqlite3.connect(store_path) as conn:
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+            except sqlite3.DatabaseError:
+                return False
+        return row is not None and row[0] == self.source
+
+    def _build(self, dump_path: str, store_path: str) -> None:
+        print(f'-building wikidata store {store_path} from {dump_path}')
+        tmp_path = store_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE entities (id TEXT PRIMARY KEY, location TEXT, popularity INTEGER);
+            CREATE TABLE instances (id TEXT, class TEXT);
+            CREATE TABLE claims (id TEXT, prop TEXT, value TEXT, value_id TEXT);
+            CREATE TABLE labels (id TEXT, lang TEXT, label TEXT);
+        """)
+        rows = {'entities': [], 'instances': [], 'claims': [], 'labels': []}
+        inserts = {'entities': 'INSERT OR REPLACE INTO entities VALUES (?, ?, ?)', 'instances': 'INSERT INTO instances VALUES (?, ?)',
+                   'claims': 'INSERT INTO claims VALUES (?, ?, ?, ?)', 'labels': 'INSERT INTO labels VALUES (?, ?, ?)'}
+
+        def flush():
+            for table, values in rows.items():
+                conn.executemany(inserts[table], values)
+                values.clear()
+
+        with _open_dump(dump_path) as dump:
+            for num, line in enumerate(tqdm(dump, desc='-reading wikidata dump', unit=' entities')):
+                line = line.strip().rstrip(',')
+                if line in ['[', ']', '']:
+                    continue
+                entity = json.loads(line)
+                self._add_entity(entity, rows)
+                if num % INSERT_BATCH == 0:
+                    flush()
+        flush()
+
+        print('-indexing wikidata store')
+        conn.executescript("""
+            CREATE INDEX instances_id ON instances (id);
+            CREATE INDEX instances_class ON instances (class);
+            CREATE INDEX claims_id ON claims (id);
+            CREATE UNIQUE INDEX labels_id ON labels (id, lang);
+        """)
+        conn.execute("INSERT INTO meta VALUES ('source', ?)", (self.source,))
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, store_path)
+
+    def _add_entity(self, entity: dict, rows: dict) -> None:
+        wkid = entity['id']
+        for lang in self.languages:
+            label = entity.get('labels', {}).get(lang)
+            if label:
+                rows['labels'].append((wkid, lang, label['value']))
+
+        claims = entity.get('claims', {})
+        snaks = {prop: [s['mainsnak'] for s in statements if s['mainsnak'].get('snaktype') == 'value']
+                 for prop, statements in claims.items()}
+        countries = [_datavalue_id(s['datavalue']['value']) for s in snaks.get('P17', [])]
+        if self.country_id not in countries:
+            return
+
+        # entities without coordinates keep their statements for readRDFWikidata but are no class members
+        location = _format_value(snaks['P625'][0]['datavalue'])[0] if snaks.get('P625') else None
+        rows['entities'].append((wkid, location, len(claims)))
+        for prop, prop_snaks in snaks.items():
+            for snak in prop_snaks:
+                value, value_id = _format_value(snak['datavalue'])
+                rows['claims'].append((wkid, prop, value, value_id))
+                if prop == 'P31' and value_id:
+                    rows['instances'].append((wkid, value_id))
+
+
+def get_backend(config):
+    """
+    backend selected in the wikidata scrape config section
+    :param config: parsed experiment config
+    :return: SparqlBackend or DumpBackend
+    """
+    if config.get('wikidata scrape', 'backend', fallback='sparql') == 'dump':
+        return DumpBackend(config.get('wikidata scrape', 'dump_location'),
+                           config.get('wikidata scrape', 'store_location', fallback='./wikidata store.sqlite'),
+                           config.get('wikidata scrape', 'country_id'),
+                           [config.get('wikidata scrape', 'name_language', fallback='en')])
+    return SparqlBackend(config)
@@ -0,0 +1,32 @@
+import candidateStore
+
+
+def write_store(tmp_path):
+    store = candidateStore.CandidateStore(str(tmp_path), 'dist', ['properties', 'type'])
+    train = store.writer('train')
+    unmatched = store.writer('unmatched')
+    train.put_many([['Q1', 10, True, 0.0, 'amenity cafe', 'cafe Q1', 'cafe'],
+                    ['Q1', 11, False, 12.5, 'shop bakery', 'cafe Q1', 'cafe']])
+    unmatched.put_many([['Q2', 11, False, 3.0, 'shop bakery', 'bakery Q2', 'shop']])
+    store.close()
+
+
+def test_pairs_gather_entity_columns(tmp_path):
+    write_store(tmp_path)
+    pairs = candidateStore.load_pairs(str(tmp_path), 'train')
+    assert len(pairs) == 2
+    assert pairs.columns == ['wkid', 'osm_id', 'match', 'dist', 'tags', 'properties', 'type']
+    assert pairs['tags'].tolist() == ['amenity cafe', 'shop bakery']
+    assert pairs['properties'].tolist() == ['cafe Q1', 'cafe Q1']
+    assert pairs['dist'].tolist() == [0.0, 12.5]
+
+
+def test_entities_are_shared_between_sets(tmp_path):
+    write_store(tmp_path)
+    pairs = candidateStore.load_pairs(str(tmp_path), 'unmatched')
+    values, rows = pairs.entities('tags')
+    assert len(values) == 2
+    assert values.iloc[rows].tolist() == ['shop bakery']
+    frame = pairs.frame(['type'])
+    assert list(frame.columns) == ['wkid', 'osm_id', 'match', 'dist', 'type']
+    assert frame['type'].tolist() == ['shop']
@@ -0,0 +1,30 @@
+import os
+import dbpediaBackend
+
+DE_DUMP = """<http://de.dbpedia.org/resource/Berlin> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://dbpedia.org/ontology/City> .
+<http://de.dbpedia.org/resource/Berlin> <http://dbpedia.org/ontology/country> <http://dbpedia.org/resource/Germany> .
+<http://de.dbpedia.org/resource/Berlin> <http://www.w3.org/2003/01/geo/wgs84_pos#lat> "52.52"^^<http://www.w3.org/2001/XMLSchema#float> .
+<http://de.dbpedia.org/resource/Berlin> <http://www.w3.org/2003/01/geo/wgs84_pos#long> "13.40"^^<http://www.w3.org/2001/XMLSchema#float> .
+<http://de.dbpedia.org/resource/Berlin> <http://www.w3.org/2000/01/rdf-schema#label> "Berlin"@de .
+"""
+
+
+def make_backend(tmp_path):
+    os.makedirs(tmp_path / 'dumps' / 'de')
+    (tmp_path / 'dumps' / 'de' / 'triples.nt').write_text(DE_DUMP, encoding='utf-8')
+    return dbpediaBackend.DumpBackend(str(tmp_path / 'dumps' / '{language}'), str(tmp_path / 'dbpedia {language}.sqlite'))
+
+
+def test_properties_from_dump(tmp_path):
+    backend = make_backend(tmp_path)
+    values = backend.properties('de', ['Berlin', 'Hamburg'])
+    assert ['http://www.w3.org/2000/01/rdf-schema#label', 'Berlin'] in values['Berlin']
+    assert values['Hamburg'] == []
+
+
+def test_language_without_dump(tmp_path):
+    backend = make_backend(tmp_path)
+    assert backend.properties('en', ['Berlin']) == {'Berlin': []}
+    assert list(backend.class_members('en', 'Germany', ['City'])) == [('City', [])]
+    # languages with a dump still work after a missing one
+    assert list(backend.class_members('de', 'Germany', ['City'])) == [('City', [['Berlin', 'Point(13.4 52.52)']])]
@@ -0,0 +1,24 @@
+import os
+import numpy as np
+import embeddingCache
+
+
+def test_vectors_of_a_replaced_model_are_not_served(tmp_path):
+    model_path = tmp_path / 'model.bin'
+    model_path.write_bytes(b'first model')
+    cache = embeddingCache.EmbeddingCache(str(tmp_path / 'cache.sqlite'))
+    key = embeddingCache.string_key('amenity cafe')
+    cache.put_many(embeddingCache.model_key(str(model_path)), 'text', {key: np.ones(3)})
+    found = cache.get_many(embeddingCache.model_key(str(model_path)), 'text', [key])
+    assert np.array_equal(found[key], np.ones(3, dtype=np.float32))
+
+    model_path.write_bytes(b'second, retrained model')
+    os.utime(model_path, ns=(0, 10 ** 9))
+    assert cache.get_many(embeddingCache.model_key(str(model_path)), 'text', [key]) == {}
+    cache.close()
+
+
+def test_disabled_cache():
+    cache = embeddingCache.EmbeddingCache('')
+    cache.put_many('model', 'text', {'key': np.ones(3)})
+    assert cache.get_many('model', 'text', ['key']) == {}
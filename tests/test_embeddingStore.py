@@ -0,0 +1,17 @@
+import numpy as np
+import embeddingStore
+import resources
+
+
+def test_features_are_memory_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(resources, '_publishing', True)
+    dataset_path = str(tmp_path / 'el training set.parquet')
+    matrix = np.arange(12, dtype=np.float32).reshape(3, 4)
+    embeddingStore.write_matrix(dataset_path, matrix)
+    assert embeddingStore.matrix_path(dataset_path) == str(tmp_path / 'el training set embeddings.npy')
+    # published matrices are handed out once, the next read maps the file
+    assert embeddingStore.load_features(dataset_path) is matrix
+    features = embeddingStore.load_features(dataset_path)
+    assert isinstance(features, np.memmap)
+    assert features.dtype == np.float32
+    assert np.array_equal(features, matrix)
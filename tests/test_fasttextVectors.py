@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import fasttextVectors
+
+fasttext = pytest.importorskip('fasttext')
+
+CORPUS = """die hauptstraße führt zum bahnhof und zur kirche
+name=Bäckerei Müller shop=bakery opening_hours=Mo-Fr 07:00-18:00
+la gare de lyon est une gare parisienne
+amenity=restaurant cuisine=italian name=Pizzeria Roma
+"""
+
+
+@pytest.fixture(scope='module')
+def model(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('fasttext')
+    corpus = folder / 'corpus.txt'
+    corpus.write_text(CORPUS * 20, encoding='utf-8')
+    model_path = str(folder / 'model.bin')
+    ft = fasttext.train_unsupervised(str(corpus), dim=16, minn=2, maxn=4, minCount=1, bucket=5000, epoch=1, thread=1)
+    ft.save_model(model_path)
+    fasttextVectors.export_model(ft, model_path, str(folder / 'vectors'))
+    return ft, model_path, str(folder / 'vectors')
+
+
+def test_fnv_hash():
+    assert fasttextVectors.fnv_hash(b'a') == 0xe40c292c
+    assert fasttextVectors.fnv_hash(b'foobar') == 0xbf9cf968
+
+
+def test_word_vector_matches_fasttext(model):
+    ft, model_path, path = model
+    vectors = fasttextVectors.MappedVectors(path)
+    texts = ['hauptstraße', 'bahnhof', 'Bäckerei Müller', 'name=Pizzeria Roma cuisine=italian', 'unbekannt', 'ü', '', '</s>']
+    expected = np.array([ft.get_word_vector(text) for text in texts])
+    assert np.allclose(vectors.encode(texts), expected, atol=1e-6)
+    assert np.allclose(vectors.word_vector('bahnhof'), ft.get_word_vector('bahnhof'), atol=1e-6)
+    assert fasttextVectors.is_exported(path, model_path)
+
+
+def test_parallel_encoder(model):
+    ft, _, path = model
+    if not fasttextVectors.can_fork():
+        pytest.skip('requires the fork start method')
+    texts = [line for line in CORPUS.splitlines()] * 3
+    encoder = fasttextVectors.ParallelEncoder(path, 2, chunk_size=4)
+    try:
+        encoded = encoder.encode(texts)
+    finally:
+        encoder.close()
+    assert np.allclose(encoded, np.array([ft.get_word_vector(text) for text in texts]), atol=1e-6)
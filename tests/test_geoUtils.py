@@ -0,0 +1,29 @@
+import numpy as np
+import geoUtils
+
+
+def test_hilbert_keys_use_the_bounding_box():
+    # points in germany, far from the equator and prime meridian
+    lon = np.array([5.0, 15.0, 5.0, 15.0, 10.0])
+    lat = np.array([47.0, 47.0, 55.0, 55.0, 51.0])
+    keys = geoUtils.hilbert_keys(lon, lat, bits=2)
+    # corners of the box fall into the corner cells of the 4 x 4 grid, visited by the curve at 0, 5, 10 and 15
+    assert sorted(keys[:4].tolist()) == [0, 5, 10, 15]
+    assert len(set(keys.tolist())) == 5
+
+
+def test_hilbert_keys_empty():
+    assert len(geoUtils.hilbert_keys(np.zeros(0), np.zeros(0))) == 0
+    assert len(geoUtils.curve_order(np.zeros(0), np.zeros(0), 'hilbert')) == 0
+
+
+def test_parse_points_with_missing_locations():
+    lon, lat = geoUtils.parse_points(['Point(13.4 52.52)', None, float('nan'), 'Point()'])
+    assert lon[0] == 13.4 and lat[0] == 52.52
+    assert np.isnan(lon[1:]).all() and np.isnan(lat[1:]).all()
+
+
+def test_curve_order_puts_missing_points_last():
+    lon = np.array([15.0, np.nan, 5.0])
+    lat = np.array([55.0, np.nan, 47.0])
+    assert geoUtils.curve_order(lon, lat, 'geohash').tolist() == [2, 0, 1]
@@ -0,0 +1,20 @@
+import numpy as np
+import nameIndex
+
+NAMES = ['Hauptstraße', 'Bahnhofstraße', 'Berliner Straße', 'Marienkirche', None, 'Markt']
+
+
+def test_trigrams_like_pg_trgm():
+    assert nameIndex.trigrams('Cat') == {'  c', ' ca', 'cat', 'at '}
+    assert nameIndex.trigrams(None) == set()
+
+
+def test_chunked_query_matches_single_product():
+    queries = ['Hauptstrasse', 'Marktkirche', 'Bahnhof', '']
+    expected = nameIndex.TrigramIndex(NAMES).query(queries, limit=3, min_similarity=0.1)
+    chunked = nameIndex.TrigramIndex(NAMES, max_pairs=1).query(queries, limit=3, min_similarity=0.1)
+    assert len(chunked) == len(queries)
+    for (positions, similarity), (chunk_positions, chunk_similarity) in zip(expected, chunked):
+        assert np.array_equal(positions, chunk_positions)
+        assert np.allclose(similarity, chunk_similarity)
+    assert expected[0][0][0] == 0
@@ -0,0 +1,103 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import pytest
+import sparqlClient
+
+
+class StandInEndpoint(BaseHTTPRequestHandler):
+    """
+    local stand-in sparql endpoint, the query decides the answer:
+    'sleep <seconds>' answers after a delay, 'busy' answers 429 with Retry-After once, 'bad' answers 400
+    """
+    def do_POST(self):
+        server = self.server
+        query = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))['query'][0]
+        with server.lock:
+            server.requests.append((query, time.monotonic()))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            if query.startswith('sleep'):
+                time.sleep(float(query.split()[1]))
+                self._answer(200, {'query': query})
+            elif query == 'busy' and [q for q, _ in server.requests].count('busy') == 1:
+                self._answer(429, {}, {'Retry-After': '0.5'})
+            elif query == 'bad':
+                self._answer(400, {})
+            else:
+                self._answer(200, {'query': query})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _answer(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/sparql-results+json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def endpoint():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInEndpoint)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.in_flight = 0
+    server.max_in_flight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f'http://127.0.0.1:{server.server_address[1]}/sparql'
+    server.shutdown()
+    server.server_close()
+
+
+def test_results_in_query_order(endpoint):
+    server, url = endpoint
+    client = sparqlClient.SparqlClient(requests_per_second=0, max_in_flight=4, timeout=5, max_retries=0)
+    # earlier queries answer later
+    queries = [f'sleep {0.05 * (6 - i)}' for i in range(6)]
+    results = list(client.query_many(url, queries))
+    client.close()
+    assert [r['query'] for r in results] == queries
+    assert 1 < server.max_in_flight <= 4
+
+
+def test_retry_after_delays_retry(endpoint):
+    server, url = endpoint
+    client = sparqlClient.SparqlClient(requests_per_second=0, max_in_flight=2, timeout=5, max_retries=2)
+    assert client.query(url, 'busy') == {'query': 'busy'}
+    client.close()
+    (_, first), (_, retry) = server.requests
+    assert retry - first >= 0.5
+
+
+def test_client_error_is_not_retried(endpoint):
+    server, url = endpoint
+    client = sparqlClient.SparqlClient(requests_per_second=0, max_in_flight=2, timeout=5, max_retries=2)
+    assert list(client.query_many(url, ['bad', 'good'])) == [None, {'query': 'good'}]
+    client.close()
+    assert [q for q, _ in server.requests].count('bad') == 1
+
+
+def test_endpoints_have_their_own_workers(endpoint):
+    server, url = endpoint
+    client = sparqlClient.SparqlClient(requests_per_second=0, max_in_flight=2, timeout=5, max_retries=0)
+    # two urls of the same server stand in for two endpoints, each may have two queries in flight
+    threads = [threading.Thread(target=lambda u=u: list(client.query_many(u, ['sleep 0.3'] * 2)))
+               for u in [url, url + '?chapter=fr']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    client.close()
+    assert server.max_in_flight == 4
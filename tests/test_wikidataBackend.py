@@ -0,0 +1,85 @@
+import json
+import configparser
+import wikidataBackend
+
+
+def entity(wkid: str, label: str, claims: dict) -> dict:
+    return {'id': wkid, 'labels': {'en': {'language': 'en', 'value': label}},
+            'claims': {prop: [{'mainsnak': {'snaktype': 'value', 'property': prop, 'datavalue': value}}
+                              for value in values] for prop, values in claims.items()}}
+
+
+def item(numeric_id: int) -> dict:
+    # older dumps carry only the numeric-id of entity values
+    return {'type': 'wikibase-entityid', 'value': {'entity-type': 'item', 'numeric-id': numeric_id}}
+
+
+DUMP = [
+    entity('Q64', 'Berlin', {'P17': [item(183)], 'P31': [item(515)],
+                             'P625': [{'type': 'globecoordinate', 'value': {'latitude': 52.52, 'longitude': 13.4}}]}),
+    entity('Q1055', 'Hamburg Port', {'P17': [item(183)], 'P31': [item(515)]}),
+    entity('Q90', 'Paris', {'P17': [item(142)], 'P31': [item(515)],
+                            'P625': [{'type': 'globecoordinate', 'value': {'latitude': 48.85, 'longitude': 2.35}}]}),
+    entity('Q515', 'city', {}),
+]
+
+
+def make_backend(tmp_path):
+    dump = tmp_path / 'wikidata.json'
+    dump.write_text('[\n' + ',\n'.join(json.dumps(e) for e in DUMP) + '\n]\n', encoding='utf-8')
+    return wikidataBackend.DumpBackend(str(dump), str(tmp_path / 'wikidata store.sqlite'), 'Q183', ['en'])
+
+
+def test_class_members_with_numeric_ids(tmp_path):
+    backend = make_backend(tmp_path)
+    assert list(backend.class_members('Q183', ['Q515'])) == [('Q515', [['Q64', 'Point(13.4 52.52)']])]
+
+
+def test_statements_without_coordinates(tmp_path):
+    backend = make_backend(tmp_path)
+    statements = backend.statements(['Q1055', 'Q90'])
+    assert {'wdLabel': 'P31', 'ps_Label': 'city'} in [{'wdLabel': b['wdLabel']['value'], 'ps_Label': b['ps_Label']['value']}
+                                                      for b in statements['Q1055']]
+    # entities outside the country are not kept
+    assert statements['Q90'] == []
+
+
+class StubClient:
+    """
+    sparql client answering every query with canned result bindings
+    """
+    def __init__(self, bindings: list):
+        self.bindings = bindings
+        self.queries = []
+
+    def query_many(self, endpoint, queries, timeout=None):
+        for query in queries:
+            self.queries.append(query)
+            yield {'results': {'bindings': self.bindings}}
+
+
+def make_sparql_backend(monkeypatch, bindings: list):
+    client = StubClient(bindings)
+    monkeypatch.setattr(wikidataBackend.resources, 'get_sparql_client', lambda config: client)
+    config = configparser.ConfigParser()
+    return wikidataBackend.SparqlBackend(config), client
+
+
+def test_sparql_popularity(monkeypatch):
+    backend, client = make_sparql_backend(monkeypatch, [{'kgentity': {'value': wikidataBackend.ENTITY_PREFIX + 'Q64'},
+                                                         'prop': {'value': '42'}}])
+    assert backend.popularity(['Q64', 'Q1055']) == {'Q64': 42, 'Q1055': 0}
+    assert 'wd:Q64 wd:Q1055' in client.queries[0]
+
+
+def test_sparql_class_members(monkeypatch):
+    backend, _ = make_sparql_backend(monkeypatch, [{'item': {'value': wikidataBackend.ENTITY_PREFIX + 'Q64'},
+                                                    'location': {'value': 'Point(13.4 52.52)'}}])
+    assert list(backend.class_members('Q183', ['Q515'])) == [('Q515', [['Q64', 'Point(13.4 52.52)']])]
+
+
+def test_sparql_statements(monkeypatch):
+    binding = {'kgentity': {'value': wikidataBackend.ENTITY_PREFIX + 'Q64'}, 'wdLabel': {'value': 'instance of'},
+               'ps_': {'value': wikidataBackend.ENTITY_PREFIX + 'Q515'}, 'ps_Label': {'value': 'city'}}
+    backend, _ = make_sparql_backend(monkeypatch, [binding])
+    assert backend.statements(['Q64', 'Q90']) == {'Q64': [binding], 'Q90': []}